@@ -69,6 +69,9 @@ Caractéristiques Techniques:
             'clinic/static/src/js/manager_dashboard.js',
             'clinic/static/src/xml/manager_dashboard.xml',
 
+            'clinic/static/src/js/waiting_board.js',
+            'clinic/static/src/xml/waiting_board.xml',
+
         ],
     },
     'demo': [
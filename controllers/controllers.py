@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from datetime import date
 
-from odoo import http, fields
+from odoo import http, fields, _
+from odoo.exceptions import UserError
 from odoo.http import request, _logger
 import json
 
@@ -41,3 +42,47 @@ class ClinicController(http.Controller):
             'gender': pat.gender or '',
             'phone': pat.phone or '',
         }
+
+    @http.route('/clinic/appointment/free_slots', type='json', auth='user')
+    def appointment_free_slots(self, doctor_ids=None, room_ids=None, date_from=None, date_to=None, duration=0.5):
+        """Return the free slots of the given doctors / rooms, see clinic.appointment.find_free_slots."""
+        return request.env['clinic.appointment'].find_free_slots(
+            doctor_ids=doctor_ids, room_ids=room_ids,
+            date_from=date_from, date_to=date_to, duration=duration)
+
+    @http.route('/clinic/encounter/bootstrap', type='json', auth='user')
+    def encounter_bootstrap(self, encounter_id=None):
+        """Doctor, current encounter, patient card, observations, prescriptions and history in one call."""
+        return request.env['clinic.encounter'].get_doctor_bootstrap(encounter_id=encounter_id)
+
+    @http.route('/clinic/encounter/batch', type='json', auth='user')
+    def encounter_batch(self, encounter_id, operations):
+        """Apply a batch of observation / prescription operations, see clinic.encounter.apply_clinical_operations."""
+        try:
+            encounter = request.env['clinic.encounter'].browse(int(encounter_id)).exists()
+        except (TypeError, ValueError):
+            encounter = request.env['clinic.encounter']
+        if not encounter:
+            raise UserError(_("La consultation %s n'existe pas ou a été supprimée.", encounter_id))
+        return encounter.apply_clinical_operations(operations)
+
+    @http.route('/clinic/patient/flowsheet', type='json', auth='user')
+    def patient_flowsheet(self, patient_id, codes=None, date_from=None, date_to=None, buckets=None):
+        """Observation time series of a patient, see clinic.observation.get_flowsheet."""
+        return request.env['clinic.observation'].get_flowsheet(
+            patient_id, codes=codes, date_from=date_from, date_to=date_to, buckets=buckets)
+
+    @http.route('/clinic/code/autocomplete', type='json', auth='user')
+    def code_autocomplete(self, system, term, limit=20):
+        """Clinical codes (LOINC, ICD-10) starting with or matching term."""
+        return request.env['clinic.clinical.code'].autocomplete(system, term, limit=limit)
+
+    @http.route('/clinic/patient/lookup', type='json', auth='user')
+    def patient_lookup(self, term, limit=20):
+        """Ranked patients matching a name, CHIFA number, identifier or phone, see res.partner.lookup_patients."""
+        return request.env['res.partner'].lookup_patients(term, limit=limit)
+
+    @http.route('/clinic/waiting_board/data', type='json', auth='user')
+    def waiting_board_data(self, service_ids=None):
+        """Initial state of the waiting-room board, updates then arrive on the bus."""
+        return request.env['clinic.appointment'].get_waiting_board(service_ids=service_ids)
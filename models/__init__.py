@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 
+from . import sequence
+from . import dashboard
 from . import partner
 from . import act
+from . import catalog_resync
+from . import doctor_ledger
 from . import cash
+from . import invoicing_run
+from . import claim_batch
 from . import convention
 from . import appointment
 from . import consultation
+from . import reference_range
+from . import clinical_code
 from . import admission
 from . import medical_history
 from . import hc_base
 from . import prescription
 from . import hospitalisation
 from . import operating_room
+from . import ir_websocket
@@ -8,17 +8,32 @@ class Act(models.Model):
     code = fields.Char(string='Code', required=False, help="Code unique de l'acte médical")
     is_medical_act = fields.Boolean(string='Est un acte médical', default=False, help="Indique si le produit est un acte médical")
 
-    @api.model
-    def create(self, vals):
-        if vals.get('is_medical_act', True):
+    @api.model_create_multi
+    def create(self, vals_list):
+        acts = [vals for vals in vals_list if vals.get('is_medical_act', True)]
+        to_number = [vals for vals in acts if not vals.get('code')]
+        codes = self.env['ir.sequence'].next_by_code_batch('clinic.act', len(to_number))
+        for vals in acts:
             vals['type'] = 'service'
             vals['invoice_policy'] = 'order'
-            if not vals.get('code'):
-                code =self.env['ir.sequence'].next_by_code('clinic.act') or _('ACT000')
-                vals['default_code'] = code
-                vals['code'] = code
-        return super(Act, self).create(vals)
+        for vals, code in zip(to_number, codes):
+            code = code or _('ACT000')
+            vals['default_code'] = code
+            vals['code'] = code
+        return super(Act, self).create(vals_list)
 
     _sql_constraints = [
         ('code_unique', 'UNIQUE(code, company_id)', 'Le code de l\'acte doit être unique par compagnie !'),
-    ]
\ No newline at end of file
+    ]
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'name' in vals or 'categ_id' in vals:
+            # les lignes d'encaissement historiques sont mises à jour en arrière-plan
+            acts = self.product_variant_ids.filtered('is_medical_act')
+            self.env['clinic.catalog.resync'].sudo()._enqueue(acts)
+        return result
@@ -3,6 +3,8 @@ from odoo import api, fields, models
 class Admission(models.Model):
     _name = "clinic.admission"
     _description = "Séjour / Admission"
+    _inherit = ['clinic.dashboard.mixin']
+    _dashboard_sections = ('admissions',)
 
     name = fields.Char("N° Admission", readonly=True, copy=False)
     patient_id = fields.Many2one('res.partner', string='Patient', domain="[('patient', '=', True)]", required=True)
@@ -46,10 +48,12 @@ class Admission(models.Model):
         self.state = 'admitted'
 
 
-    @api.model
-    def create(self, vals):
-        vals["name"] = self.env["ir.sequence"].next_by_code("clinic.admission")
-        return super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        names = self.env["ir.sequence"].next_by_code_batch("clinic.admission", len(vals_list))
+        for vals, name in zip(vals_list, names):
+            vals["name"] = name
+        return super().create(vals_list)
 
 class AdmissionMove(models.Model):
     _name = "clinic.admission.move"
@@ -1,12 +1,77 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import frozendict
+from odoo.tools.sql import create_index
 from datetime import datetime, timedelta
 
+from .hc_base import ensure_btree_gist
+
+# Créneau d'un RDV [début, fin) ; doit rester identique à l'expression des index GiST
+APPOINTMENT_PERIOD_SQL = "tsrange({0}date_rdv, GREATEST({0}date_rdv, {0}date_rdv_end), '[)')"
+
+# Séquences des étapes de la file d'attente (data/queue_stage_data.xml)
+STAGE_ATTENTE = 1
+STAGE_EN_COURS = 2
+STAGE_TERMINE = 3
+
+# Champs affichés par le tableau de la salle d'attente ; leur modification y est diffusée
+BOARD_FIELDS = ['name', 'patient_id', 'doctor_id', 'room_id', 'service_id', 'date_rdv', 'etat', 'etape_file',
+                'priorite']
+
+
+# Nom sous lequel le client demande le canal d'un service ; ir.websocket ne l'accorde qu'aux
+# utilisateurs autorisés, sous la forme du canal d'enregistrement de _board_channel
+BOARD_CHANNEL_PREFIX = 'clinic_waiting_board_'
+
+
+def _board_channel_name(service_id):
+    """Nom du canal d'un service demandé par le client (0 : rendez-vous sans service)."""
+    return '%s%s' % (BOARD_CHANNEL_PREFIX, service_id or 0)
+
+
+def _board_channel(env, service_id):
+    """Canal du bus d'un service, rattaché à l'enregistrement (vide : rendez-vous sans service)."""
+    return (env['clinic.service'].browse(service_id or ()), 'clinic_waiting_board')
+
+
+def _free_intervals(busy, capacity, date_from, date_to):
+    """Balayage : intervalles de [date_from, date_to) où moins de `capacity` créneaux occupés se chevauchent."""
+    # à instant égal, les fins (-1) passent avant les débuts (+1)
+    events = sorted([(start, 1) for start, end in busy] + [(end, -1) for start, end in busy])
+    free, load, free_since = [], 0, date_from
+    for moment, delta in events:
+        was_free = load < capacity
+        load += delta
+        if was_free and load >= capacity:
+            if moment > free_since:
+                free.append((free_since, moment))
+        elif not was_free and load < capacity:
+            free_since = moment
+    if load < capacity and date_to > free_since:
+        free.append((free_since, date_to))
+    return free
+
+
+def _intersect_intervals(first, second):
+    """Intersection de deux listes triées d'intervalles disjoints."""
+    result, i, j = [], 0, 0
+    while i < len(first) and j < len(second):
+        start = max(first[i][0], second[j][0])
+        end = min(first[i][1], second[j][1])
+        if start < end:
+            result.append((start, end))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
 
 class Appointment(models.Model):
     _name = "clinic.appointment"
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'clinic.dashboard.mixin']
     _description = "Rendez-vous"
+    _dashboard_sections = ('appointments',)
     _order = "date_rdv desc, priorite desc, name"
     _rec_name = 'display_name'
 
@@ -103,7 +168,8 @@ class Appointment(models.Model):
     bon_id = fields.Many2one(
         comodel_name='clinic.cash_entry',
         string='N°BON',
-        ondelete='restrict'
+        ondelete='restrict',
+        index=True
     )
 
     # === AUTRES CHAMPS ===
@@ -121,50 +187,98 @@ class Appointment(models.Model):
         compute='_compute_can_start_encounter'
     )
 
+    def init(self):
+        # Index GiST sur les créneaux pour la détection des conflits médecin / salle
+        has_btree_gist = ensure_btree_gist(self.env.cr)
+        for column in ('doctor_id', 'room_id'):
+            create_index(
+                self.env.cr, 'clinic_appointment_%s_period_idx' % column, self._table,
+                [column, APPOINTMENT_PERIOD_SQL.format('')] if has_btree_gist
+                else [APPOINTMENT_PERIOD_SQL.format('')],
+                method='gist', where="etat NOT IN ('annule', 'termine')",
+            )
+
+    def _get_availability_conflicts(self):
+        """
+        Détecte en deux requêtes les conflits médecin et salle de tout le recordset : un médecin
+        ne peut avoir qu'un RDV à la fois, une salle autant que sa capacité.
+        Retourne une liste de dictionnaires (type, appointment, conflicting).
+        """
+        candidates = self.filtered(lambda a: a.id and a.etat != 'annule')
+        if not candidates:
+            return []
+        self.flush_model(['doctor_id', 'room_id', 'date_rdv', 'date_rdv_end', 'etat'])
+        self.env['clinic.consultation.room'].flush_model(['capacity'])
+        period_a = APPOINTMENT_PERIOD_SQL.format('a.')
+        period_b = APPOINTMENT_PERIOD_SQL.format('b.')
+        self.env.cr.execute("""
+            SELECT a.id, b.id
+              FROM clinic_appointment a
+              JOIN clinic_appointment b
+                ON b.doctor_id = a.doctor_id
+               AND b.id != a.id
+               AND b.etat NOT IN ('annule', 'termine')
+               AND {period_b} && {period_a}
+             WHERE a.id IN %(ids)s
+          ORDER BY 1, 2
+        """.format(period_a=period_a, period_b=period_b), {'ids': tuple(candidates.ids)})
+        rows = [('doctor', a_id, b_id) for a_id, b_id in self.env.cr.fetchall()]
+
+        self.env.cr.execute("""
+            SELECT a.id, b.id, GREATEST(r.capacity, 1),
+                   a.date_rdv, GREATEST(a.date_rdv, a.date_rdv_end),
+                   b.date_rdv, GREATEST(b.date_rdv, b.date_rdv_end)
+              FROM clinic_appointment a
+              JOIN clinic_consultation_room r ON r.id = a.room_id
+              JOIN clinic_appointment b
+                ON b.room_id = a.room_id
+               AND b.id != a.id
+               AND b.etat NOT IN ('annule', 'termine')
+               AND {period_b} && {period_a}
+             WHERE a.id IN %(ids)s
+          ORDER BY 1, 2
+        """.format(period_a=period_a, period_b=period_b), {'ids': tuple(candidates.ids)})
+        overlaps = {}
+        for a_id, b_id, capacity, a_start, a_end, b_start, b_end in self.env.cr.fetchall():
+            overlaps.setdefault((a_id, capacity, a_start, a_end), []).append((b_id, b_start, b_end))
+        for (a_id, capacity, a_start, a_end), others in overlaps.items():
+            # la salle est pleine si, à un instant du RDV, `capacity` autres RDV s'y chevauchent
+            busy = [(max(b_start, a_start), min(b_end, a_end)) for __, b_start, b_end in others]
+            if capacity == 1 or _free_intervals(busy, capacity, a_start, a_end) != [(a_start, a_end)]:
+                rows += [('room', a_id, b_id) for b_id, __, __ in others]
+
+        prefetch_ids = {row[1] for row in rows} | {row[2] for row in rows}
+        conflicts = []
+        seen = set()
+        for kind, appointment_id, conflicting_id in rows:
+            # un conflit entre deux RDV du même lot n'est signalé qu'une fois
+            key = (kind, frozenset((appointment_id, conflicting_id)))
+            if key in seen:
+                continue
+            seen.add(key)
+            conflicts.append({
+                'type': kind,
+                'appointment': self.browse(appointment_id).with_prefetch(prefetch_ids),
+                'conflicting': self.browse(conflicting_id).with_prefetch(prefetch_ids),
+            })
+        return conflicts
+
     @api.constrains('date_rdv', 'doctor_id', 'room_id')
     def _check_availability(self):
         """Vérifier la disponibilité du médecin et de la salle"""
-        for appointment in self:
-            if appointment.etat in ['annule']:
-                continue
-
-            # Vérifier les conflits de médecin
-            if appointment.doctor_id:
-                conflicting_doctor = self.search([
-                    ('doctor_id', '=', appointment.doctor_id.id),
-                    ('date_rdv', '<=', appointment.date_rdv_end),
-                    ('date_rdv_end', '>=', appointment.date_rdv),
-                    ('etat', 'not in', ['annule', 'termine']),
-                    ('id', '!=', appointment.id)
-                ], limit=1)
-
-                if conflicting_doctor:
-                    raise ValidationError(
-                        _("Le médecin %s n'est pas disponible à ce créneau. "
-                          "Conflit avec le RDV %s") % (
-                            appointment.doctor_id.name,
-                            conflicting_doctor.name
-                        )
-                    )
-
-            # Vérifier les conflits de salle
-            if appointment.room_id:
-                conflicting_room = self.search([
-                    ('room_id', '=', appointment.room_id.id),
-                    ('date_rdv', '<=', appointment.date_rdv_end),
-                    ('date_rdv_end', '>=', appointment.date_rdv),
-                    ('etat', 'not in', ['annule', 'termine']),
-                    ('id', '!=', appointment.id)
-                ], limit=1)
-
-                if conflicting_room:
-                    raise ValidationError(
-                        _("La salle %s n'est pas disponible à ce créneau. "
-                          "Conflit avec le RDV %s") % (
-                            appointment.room_id.name,
-                            conflicting_room.name
-                        )
-                    )
+        messages = []
+        for conflict in self._get_availability_conflicts():
+            appointment = conflict['appointment']
+            if conflict['type'] == 'doctor':
+                messages.append(_("Le médecin %s n'est pas disponible à ce créneau. "
+                                  "Conflit avec le RDV %s") % (
+                    appointment.doctor_id.name, conflict['conflicting'].name))
+            else:
+                messages.append(_("La salle %s n'est pas disponible à ce créneau. "
+                                  "Conflit avec le RDV %s") % (
+                    appointment.room_id.name, conflict['conflicting'].name))
+        if messages:
+            raise ValidationError("\n".join(messages))
 
     @api.constrains('date_rdv')
     def _check_date_rdv(self):
@@ -211,44 +325,38 @@ class Appointment(models.Model):
 
     def _get_default_stage(self):
         """Retourner l'étape par défaut"""
-        return self.env['clinic.queue_stage'].search([('sequence', '=', 1)], limit=1)
+        return self.env['clinic.queue_stage']._get_stage(STAGE_ATTENTE)
 
     @api.model
     def _read_group_stage_ids(self, stages, domain, order):
         """Étendre les groupes pour afficher toutes les étapes"""
         return self.env['clinic.queue_stage'].search([], order=order)
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Surcharger create pour générer la séquence"""
-        if vals.get('name', _('Nouveau')) == _('Nouveau'):
-            vals['name'] = self.env['ir.sequence'].next_by_code('clinic.appointment') or _('Nouveau')
+        to_number = [vals for vals in vals_list if vals.get('name', _('Nouveau')) == _('Nouveau')]
+        names = self.env['ir.sequence'].next_by_code_batch('clinic.appointment', len(to_number))
+        for vals, name in zip(to_number, names):
+            vals['name'] = name or _('Nouveau')
 
-        # Auto-confirmation pour les urgences
-        if vals.get('priorite') == 'urgente' and vals.get('etat') == 'brouillon':
-            vals['etat'] = 'confirme'
+        for vals in vals_list:
+            # Auto-confirmation pour les urgences
+            if vals.get('priorite') == 'urgente' and vals.get('etat') == 'brouillon':
+                vals['etat'] = 'confirme'
 
-        return super().create(vals)
-
-    def write(self, vals):
-        """Surcharger write pour la logique métier"""
-        # Empêcher la modification des RDV terminés ou annulés
-        if any(appointment.etat in ['termine', 'annule'] for appointment in self):
-            protected_fields = {'patient_id', 'doctor_id', 'date_rdv', 'room_id'}
-            if protected_fields.intersection(set(vals.keys())):
-                raise UserError(_("Impossible de modifier un rendez-vous terminé ou annulé."))
-
-        return super().write(vals)
+        appointments = super().create(vals_list)
+        appointments._mark_board()
+        return appointments
 
     def action_confirmer(self):
-        """Confirmer le rendez-vous"""
-        self.ensure_one()
-        if self.etat != 'brouillon':
+        """Confirmer les rendez-vous (en une seule écriture pour tout le lot)"""
+        if any(appointment.etat != 'brouillon' for appointment in self):
             raise UserError(_("Seuls les rendez-vous en brouillon peuvent être confirmés."))
 
         self.write({
             'etat': 'confirme',
-            'etape_file': self.env['clinic.queue_stage'].search([('sequence', '=', 1)], limit=1).id
+            'etape_file': self.env['clinic.queue_stage']._get_stage(STAGE_ATTENTE).id
         })
 
         # Envoyer notification (si module de notification disponible)
@@ -257,25 +365,7 @@ class Appointment(models.Model):
     def action_en_cours(self):
         """Passer le rendez-vous en cours"""
         self.ensure_one()
-        if self.etat != 'confirme':
-            raise UserError(_("Seuls les rendez-vous confirmés peuvent être mis en cours."))
-        encounter_vals = {
-            'patient_id': self.patient_id.id,
-            'doctor_id': self.doctor_id.id,
-            'appointment_id': self.id,
-            'room_id': self.room_id.id if self.room_id else False,
-            'start': self.date_rdv,
-            'type': 'ambu',
-            'state': 'draft',
-        }
-
-        encounter = self.env['clinic.encounter'].create(encounter_vals)
-
-        # Mettre à jour l'appointment
-        self.write({
-            'encounter_id': encounter.id,
-            'etape_file': self.env['clinic.queue_stage'].search([('sequence', '=', 2)], limit=1).id
-        })
+        encounter = self._start_encounters()
 
         return {
             'type': 'ir.actions.act_window',
@@ -286,20 +376,42 @@ class Appointment(models.Model):
             'context': {'default_appointment_id': self.id}
         }
 
+    def _start_encounters(self):
+        """Crée les consultations du lot en une fois et passe les rendez-vous à l'étape « en cours »"""
+        if any(appointment.etat != 'confirme' for appointment in self):
+            raise UserError(_("Seuls les rendez-vous confirmés peuvent être mis en cours."))
+
+        encounters = self.env['clinic.encounter'].create([{
+            'patient_id': appointment.patient_id.id,
+            'doctor_id': appointment.doctor_id.id,
+            'appointment_id': appointment.id,
+            'room_id': appointment.room_id.id if appointment.room_id else False,
+            'start': appointment.date_rdv,
+            'type': 'ambu',
+            'state': 'draft',
+        } for appointment in self])
+
+        # Mettre à jour les rendez-vous : le lien vers la consultation est propre à chacun
+        for appointment, encounter in zip(self, encounters):
+            appointment.encounter_id = encounter
+        self.write({'etape_file': self.env['clinic.queue_stage']._get_stage(STAGE_EN_COURS).id})
+        return encounters
+
     def action_terminer(self):
-        """Terminer le rendez-vous"""
-        self.ensure_one()
-        if self.etat == 'termine':
+        """Terminer les rendez-vous (en une seule écriture pour tout le lot)"""
+        appointments = self.filtered(lambda a: a.etat != 'termine')
+        if not appointments:
             return
 
-        self.write({
+        appointments.write({
             'etat': 'termine',
-            'etape_file': self.env['clinic.queue_stage'].search([('sequence', '=', 3)], limit=1).id
+            'etape_file': self.env['clinic.queue_stage']._get_stage(STAGE_TERMINE).id
         })
 
-        # Terminer aussi la consultation si elle existe
-        if self.encounter_id and self.encounter_id.state != 'done':
-            self.encounter_id.write({
+        # Terminer aussi les consultations existantes
+        encounters = appointments.encounter_id.filtered(lambda e: e.state != 'done')
+        if encounters:
+            encounters.write({
                 'state': 'done',
                 'end': fields.Datetime.now()
             })
@@ -354,6 +466,62 @@ class Appointment(models.Model):
                 message_type='notification'
             )
 
+    @api.model
+    def find_free_slots(self, doctor_ids=None, room_ids=None, date_from=None, date_to=None, duration=0.5):
+        """
+        Retourne les créneaux libres entre date_from et date_to, d'au moins `duration` heures,
+        pour chaque couple médecin / salle (ou chaque médecin, ou chaque salle si l'un est omis).
+        Les RDV existants sont lus en une seule requête ; la capacité des salles est respectée.
+        """
+        try:
+            doctor_ids = [int(d) for d in doctor_ids or []]
+            room_ids = [int(r) for r in room_ids or []]
+        except (TypeError, ValueError):
+            raise UserError(_("Médecins ou salles invalides."))
+        # les ids inconnus (ou qui ne sont pas des médecins) sont ignorés
+        doctor_ids = self.env['res.partner'].browse(doctor_ids).exists().filtered('doctor').ids
+        rooms = self.env['clinic.consultation.room'].browse(room_ids).exists()
+        room_ids = rooms.ids
+        date_from = fields.Datetime.to_datetime(date_from) or fields.Datetime.now()
+        date_to = fields.Datetime.to_datetime(date_to) or date_from + timedelta(days=1)
+        if not (doctor_ids or room_ids) or date_to <= date_from:
+            return []
+
+        busy = {('doctor', d): [] for d in doctor_ids}
+        busy.update({('room', r): [] for r in room_ids})
+        appointments = self.search_fetch([
+            '|', ('doctor_id', 'in', doctor_ids), ('room_id', 'in', room_ids),
+            ('date_rdv', '<', date_to),
+            ('date_rdv_end', '>', date_from),
+            ('etat', 'not in', ['annule', 'termine']),
+        ], ['doctor_id', 'room_id', 'date_rdv', 'date_rdv_end'])
+        for appointment in appointments:
+            period = (max(appointment.date_rdv, date_from), min(appointment.date_rdv_end, date_to))
+            for key in (('doctor', appointment.doctor_id.id), ('room', appointment.room_id.id)):
+                if key in busy:
+                    busy[key].append(period)
+
+        capacities = {room.id: max(room.capacity, 1) for room in rooms}
+        doctor_free = {d: _free_intervals(busy[('doctor', d)], 1, date_from, date_to) for d in doctor_ids}
+        room_free = {r: _free_intervals(busy[('room', r)], capacities[r], date_from, date_to) for r in room_ids}
+
+        if doctor_ids and room_ids:
+            candidates = [(d, r, _intersect_intervals(doctor_free[d], room_free[r]))
+                          for d in doctor_ids for r in room_ids]
+        elif doctor_ids:
+            candidates = [(d, False, doctor_free[d]) for d in doctor_ids]
+        else:
+            candidates = [(False, r, room_free[r]) for r in room_ids]
+
+        min_length = timedelta(hours=duration or 0)
+        return [{
+            'doctor_id': doctor_id,
+            'room_id': room_id,
+            'start': fields.Datetime.to_string(start),
+            'end': fields.Datetime.to_string(end),
+        } for doctor_id, room_id, intervals in candidates
+            for start, end in intervals if end - start >= min_length]
+
     @api.model
     def get_appointment_stats(self, date_from=None, date_to=None):
         """Retourner les statistiques des rendez-vous"""
@@ -390,6 +558,9 @@ class Appointment(models.Model):
             if protected_fields.intersection(set(vals.keys())):
                 raise UserError(_("Impossible de modifier un rendez-vous terminé ou annulé."))
 
+        if set(BOARD_FIELDS).intersection(vals):
+            # le service d'avant la modification, pour retirer le RDV de son ancien tableau
+            self._mark_board()
         result = super().write(vals)
 
         # Optional: trigger dashboard opening for doctors
@@ -398,11 +569,90 @@ class Appointment(models.Model):
 
         return result
 
+    def unlink(self):
+        self._mark_board()
+        return super().unlink()
+
+    # ------------------------------------------------------------------ #
+    # Tableau de la salle d'attente                                      #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def get_waiting_board(self, service_ids=None):
+        """État initial du tableau : étapes, services et rendez-vous du jour, au format des diffusions."""
+        today = fields.Date.context_today(self)
+        start = fields.Datetime.to_datetime(today)
+        domain = [('date_rdv', '>=', start), ('date_rdv', '<', start + timedelta(days=1)),
+                  ('etat', '!=', 'annule')]
+        if service_ids:
+            domain.append(('service_id', 'in', service_ids))
+        appointments = self.search(domain, order='date_rdv')
+        services = self.env['clinic.service'].browse(service_ids) if service_ids \
+            else self.env['clinic.service'].search([])
+        return {
+            'stages': self.env['clinic.queue_stage'].search_read([], ['name', 'sequence']),
+            'services': [{'id': service.id, 'name': service.display_name} for service in services],
+            'channels': [_board_channel_name(service_id) for service_id in (service_ids or services.ids + [0])],
+            'appointments': appointments._board_values(),
+        }
+
+    def _board_values(self):
+        """Ligne compacte du tableau pour chaque rendez-vous."""
+        return [{
+            'id': appointment.id,
+            'name': appointment.name,
+            'patient': appointment.patient_id.name,
+            'doctor': appointment.doctor_id.name,
+            'room': appointment.room_id.display_name,
+            'service_id': appointment.service_id.id,
+            'date_rdv': fields.Datetime.to_string(appointment.date_rdv),
+            'etat': appointment.etat,
+            'stage_id': appointment.etape_file.id,
+            'priorite': appointment.priorite,
+        } for appointment in self]
+
+    def _mark_board(self):
+        """Programme la diffusion des rendez-vous modifiés, regroupée une fois par transaction."""
+        pending = self.env.cr.precommit.data.setdefault('clinic.waiting_board', {})
+        if not pending:
+            self.env.cr.precommit.add(self._flush_board)
+        for appointment in self:
+            pending.setdefault(appointment.id, set()).add(appointment.service_id.id)
+
+    @api.model
+    def _flush_board(self):
+        pending = self.env.cr.precommit.data.pop('clinic.waiting_board', {})
+        if not pending:
+            return
+        self.env.flush_all()
+        today = fields.Date.context_today(self)
+        appointments = self.browse(list(pending)).exists()
+        # {service: {'upsert': [...], 'remove': [...]}}
+        diffs = {}
+        for values, appointment in zip(appointments._board_values(), appointments):
+            on_board = appointment.etat != 'annule' and appointment.date_rdv \
+                and fields.Date.context_today(self, appointment.date_rdv) == today
+            diff = diffs.setdefault(values['service_id'], {'upsert': [], 'remove': []})
+            if on_board:
+                diff['upsert'].append(values)
+            else:
+                diff['remove'].append(appointment.id)
+            for service_id in pending[appointment.id] - {values['service_id']}:
+                diffs.setdefault(service_id, {'upsert': [], 'remove': []})['remove'].append(
+                    appointment.id)
+        for appointment_id in set(pending) - set(appointments.ids):
+            for service_id in pending[appointment_id]:
+                diffs.setdefault(service_id, {'upsert': [], 'remove': []})['remove'].append(
+                    appointment_id)
+        self.env['bus.bus']._sendmany([
+            (_board_channel(self.env, service_id), 'clinic_waiting_board/update', diff)
+            for service_id, diff in diffs.items()
+        ])
+
     def _try_open_doctor_dashboard(self):
         """Safely try to open doctor dashboard if encounter is started"""
         try:
             # Check if the required records exist
-            stage_en_cours = self.env['clinic.queue_stage'].search([('sequence', '=', 2)], limit=1)
+            stage_en_cours = self.env['clinic.queue_stage']._get_stage(STAGE_EN_COURS)
             encounter_manager_action = self.env.ref('clinic.encounter_manager', raise_if_not_found=False)
 
             if not stage_en_cours or not encounter_manager_action:
@@ -451,6 +701,36 @@ class QueueStage(models.Model):
         compute='_compute_appointment_count'
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        stages = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return stages
+
+    def write(self, vals):
+        result = super().write(vals)
+        if {'sequence', 'active'}.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    @api.model
+    def _get_stage(self, sequence):
+        """Étape de séquence `sequence`, sans requête une fois le registre des étapes en cache."""
+        return self.browse(self._get_stage_ids().get(sequence))
+
+    @tools.ormcache()
+    def _get_stage_ids(self):
+        """Registre {séquence: id de la première étape active}, invalidé à chaque modification des étapes."""
+        stage_ids = {}
+        for stage in self.sudo().search([], order='sequence desc, id desc'):
+            stage_ids[stage.sequence] = stage.id
+        return frozendict(stage_ids)
+
     @api.depends()
     def _compute_appointment_count(self):
         for stage in self:
@@ -1,35 +1,36 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import SQL
+
+# Encaissement (alias e) non facturé, pendant SQL de _get_unbilled_domain ; la part réclamée sur un
+# bordereau est déduite des lignes à sa facturation (_prepare_invoice_vals)
+UNBILLED_ENTRY_SQL = "e.invoice_id IS NULL"
+
+# Part d'un encaissement dans le reste à payer du patient (alias e = clinic_cash_entry)
+PATIENT_BALANCE_SQL = """
+    COALESCE(e.amount_residual, 0) - CASE
+        WHEN COALESCE(e.rest, false) AND NOT COALESCE(e.supplement, false)
+            THEN COALESCE(e.amount_payed, 0)
+        WHEN COALESCE(e.rest, false) AND COALESCE(e.supplement, false)
+            THEN COALESCE(e.amount_payed, 0) - COALESCE(e.montant, 0) - COALESCE(e.tax_amount, 0)
+        ELSE 0
+    END
+"""
+
+# Sources des totaux de relevé : {modèle: (table, montant, colonne du relevé, signe dans le solde)}
+STATEMENT_SOURCES = {
+    'clinic.cash_entry': ('clinic_cash_entry', 'amount_total', 'total_cash_entry', '+'),
+    'clinic.cash_exit': ('clinic_cash_exit', 'montant', 'total_cash_exit', '-'),
+}
 
 
 class CashStatement(models.Model):
     _name = 'clinic.cash_statement'
     _description = 'Relevé de Caisse'
-    _inherit = ['mail.thread']
+    _inherit = ['mail.thread', 'clinic.dashboard.mixin']
+    _dashboard_sections = ('cash',)
     _order = 'date desc'
 
-    @api.depends('date')
-    def _get_previous_statement(self):
-        for st in self:
-            # Search for the previous statement
-            domain = [('date', '<=', st.date)]
-            if not isinstance(st.id, models.NewId):
-                domain.extend(['|', '&', ('id', '<', st.id), ('date', '=', st.date), '&', ('id', '!=', st.id),
-                               ('date', '!=', st.date)])
-            previous_statement = self.search(domain, limit=1, order='id desc')
-            st.previous_statement_id = previous_statement.id
-            previous_statement.write({'state': 'closed', 'date_done': fields.Datetime.now()})
-
-    @api.depends('previous_statement_id', )
-    def _compute_starting_balance(self):
-        for statement in self:
-            if statement.previous_statement_id:
-                if statement.previous_statement_id.balance != statement.balance_start:
-                   statement.balance_start = statement.previous_statement_id.balance
-                else:
-                    # Need default value
-                    statement.balance_start = statement.balance_start or 0.0
-
     name = fields.Char(string='Référence', readonly=True, default=lambda self: _('Nouveau'))
     date = fields.Date(string='Date', default=fields.Date.today, required=True)
     state = fields.Selection([
@@ -38,50 +39,143 @@ class CashStatement(models.Model):
         ('closed', 'Clôturé'),
     ], string='État', default='draft', required=True)
 
-    balance_start = fields.Monetary(string='Solde Initiale', compute='_compute_starting_balance', readonly=False,
-                                    store=True)
+    balance_start = fields.Monetary(string='Solde Initiale', copy=False,
+                                    help="Solde du dernier relevé clôturé, repris à l'ouverture ; "
+                                         "saisi manuellement pour le premier relevé")
 
-    previous_statement_id = fields.Many2one('clinic.cash_statement',
-                                            help='technical field to compute starting balance correctly',
-                                            compute='_get_previous_statement', store=True)
+    previous_statement_id = fields.Many2one('clinic.cash_statement', string='Relevé précédent', readonly=True,
+                                            copy=False, help="Relevé précédent dans la chaîne, fixé à l'ouverture")
 
     cash_entry_ids = fields.One2many('clinic.cash_entry', 'statement_id', string='Encaissements')
     cash_exit_ids = fields.One2many('clinic.cash_exit', 'statement_id', string='Décaissements')
-    total_cash_entry = fields.Monetary(string='Total Encaissements', compute='_compute_totals', store=True)
-    total_cash_exit = fields.Monetary(string='Total Décaissements', compute='_compute_totals', store=True)
-    balance = fields.Monetary(string='Solde', compute='_compute_totals', store=True)
+    # maintenus par delta depuis les encaissements et décaissements (_post_statement_totals)
+    total_cash_entry = fields.Monetary(string='Total Encaissements', readonly=True, copy=False)
+    total_cash_exit = fields.Monetary(string='Total Décaissements', readonly=True, copy=False)
+    balance = fields.Monetary(string='Solde', compute='_compute_balance', store=True)
     currency_id = fields.Many2one('res.currency', string='Devise', default=lambda self: self.env.company.currency_id)
     date_done = fields.Datetime(string="Date de clôture")
 
-    @api.model
-    def create(self, vals):
-        if not vals.get('name'):
-            vals['name'] = self.env['ir.sequence'].next_by_code('clinic.cash_statement') or _('Nouveau')
-        return super(CashStatement, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [vals for vals in vals_list if not vals.get('name')]
+        names = self.env['ir.sequence'].next_by_code_batch('clinic.cash_statement', len(to_number))
+        for vals, name in zip(to_number, names):
+            vals['name'] = name or _('Nouveau')
+        return super(CashStatement, self).create(vals_list)
 
 
-    @api.depends('cash_entry_ids.amount_total', 'cash_exit_ids.montant')
-    def _compute_totals(self):
+    @api.depends('balance_start', 'total_cash_entry', 'total_cash_exit')
+    def _compute_balance(self):
         for record in self:
-            record.total_cash_entry = sum(entry.amount_total for entry in record.cash_entry_ids)
-            record.total_cash_exit = sum(exit.montant for exit in record.cash_exit_ids)
-            differance = record.total_cash_entry - record.total_cash_exit
-            record.balance = record.balance_start + differance
+            record.balance = record.balance_start + record.total_cash_entry - record.total_cash_exit
 
     def action_open(self):
+        """
+        Ouvre le relevé à la suite du dernier relevé clôturé, dont il reprend le solde. Sans relevé
+        clôturé, le solde initial saisi est conservé.
+        """
         self.ensure_one()
-        self.state = 'open'
+        if self.state != 'draft':
+            raise UserError(_("Le relevé %s est déjà ouvert ou clôturé.", self.name))
+        previous = self.search([('state', '=', 'closed'), ('id', '!=', self.id)],
+                               order='date desc, id desc', limit=1)
+        vals = {'state': 'open', 'previous_statement_id': previous.id}
+        if previous:
+            vals['balance_start'] = previous.balance
+        self.write(vals)
 
     def action_close(self):
+        """Clôture de fin de journée."""
         self.ensure_one()
-        self.state = 'closed'
+        self.write({'state': 'closed', 'date_done': fields.Datetime.now()})
 
+    # ------------------------------------------------------------------ #
+    # Totaux par delta                                                   #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _mark_statement_totals(self, records):
+        """Programme le report d'encaissements / décaissements dans les totaux des relevés."""
+        if not records:
+            return
+        data = self.env.cr.precommit.data
+        if not any(data.get('clinic.statement_totals.%s' % source) for source in STATEMENT_SOURCES):
+            self.env.cr.precommit.add(self._flush_statement_totals)
+        data.setdefault('clinic.statement_totals.%s' % records._name, set()).update(records.ids)
+
+    @api.model
+    def _flush_statement_totals(self):
+        self.env.flush_all()
+        for source in STATEMENT_SOURCES:
+            ids = self.env.cr.precommit.data.pop('clinic.statement_totals.%s' % source, set())
+            if ids:
+                self._post_statement_totals(source, list(ids))
+
+    @api.model
+    def _post_statement_totals(self, source, ids, reverse_only=False):
+        """
+        Reporte par delta le montant des enregistrements `ids` de `source` dans le total et le
+        solde de leur relevé. Avec `reverse_only`, seul le montant déjà reporté est retiré (suppression).
+        """
+        table, amount, column, sign = STATEMENT_SOURCES[source]
+        self.env.cr.execute("""
+            WITH changed AS (
+                SELECT id, statement_id, COALESCE({amount}, 0) AS amount, cash_posted, cash_posted_statement_id
+                  FROM {table}
+                 WHERE id = ANY(%(ids)s)
+                   FOR UPDATE
+            ), deltas AS (
+                SELECT statement_id, SUM(delta) AS delta FROM (
+                    SELECT statement_id, amount AS delta FROM changed WHERE NOT %(reverse_only)s
+                     UNION ALL
+                    SELECT cash_posted_statement_id, -COALESCE(cash_posted, 0)
+                      FROM changed WHERE cash_posted_statement_id IS NOT NULL
+                ) moves
+                GROUP BY statement_id
+            ), posted AS (
+                UPDATE {table} t
+                   SET cash_posted = c.amount, cash_posted_statement_id = c.statement_id
+                  FROM changed c
+                 WHERE t.id = c.id
+            )
+            UPDATE clinic_cash_statement s
+               SET {column} = COALESCE(s.{column}, 0) + d.delta,
+                   balance = COALESCE(s.balance, 0) {sign} d.delta
+              FROM deltas d
+             WHERE s.id = d.statement_id AND d.delta != 0
+        """.format(table=table, amount=amount, column=column, sign=sign),
+            {'ids': ids, 'reverse_only': reverse_only})
+        self.env[source].invalidate_model(['cash_posted', 'cash_posted_statement_id'])
+        self.invalidate_model([column, 'balance'])
+
+    @api.model
+    def _rebuild_statement_totals(self):
+        """Recalcule entièrement les totaux des relevés (initialisation ou réparation)."""
+        self.env.flush_all()
+        for table, amount, column, sign in STATEMENT_SOURCES.values():
+            self.env.cr.execute("""
+                UPDATE {table} SET cash_posted = COALESCE({amount}, 0), cash_posted_statement_id = statement_id
+            """.format(table=table, amount=amount))
+            self.env.cr.execute("UPDATE clinic_cash_statement SET {column} = 0".format(column=column))
+            self.env.cr.execute("""
+                UPDATE clinic_cash_statement s
+                   SET {column} = d.amount
+                  FROM (SELECT statement_id, SUM(cash_posted) AS amount FROM {table} GROUP BY statement_id) d
+                 WHERE s.id = d.statement_id
+            """.format(table=table, column=column))
+        self.env.cr.execute("""
+            UPDATE clinic_cash_statement
+               SET balance = COALESCE(balance_start, 0) + COALESCE(total_cash_entry, 0) - COALESCE(total_cash_exit, 0)
+        """)
+        for source in STATEMENT_SOURCES:
+            self.env[source].invalidate_model(['cash_posted', 'cash_posted_statement_id'])
+        self.invalidate_model(['total_cash_entry', 'total_cash_exit', 'balance'])
 
 
 class CashEntry(models.Model):
     _name = 'clinic.cash_entry'
     _description = 'Encaissement'
-    _inherit = ['mail.thread']
+    _inherit = ['mail.thread', 'clinic.dashboard.mixin']
+    _dashboard_sections = ('cash',)
     _order = 'date,id desc'
 
     currency_id = fields.Many2one('res.currency', string='Devise', default=lambda self: self.env.company.currency_id)
@@ -89,7 +183,7 @@ class CashEntry(models.Model):
     patient_id = fields.Many2one('res.partner', string='Patient', domain="[('patient', '=', True)]", required=True)
     doctor_id = fields.Many2one('res.partner', string='Médecin', domain="[('doctor', '=', True)]")
     statement_id = fields.Many2one('clinic.cash_statement', string='Relevé de Caisse', required=True)
-    date = fields.Date(string='Date', default=fields.Date.today, required=True)
+    date = fields.Date(string='Date', default=fields.Date.today, required=True, index=True)
     paid_by = fields.Selection([
         ('lui-même ', 'lui-même '),
         ('Conjoint', 'Conjoint'),
@@ -101,15 +195,16 @@ class CashEntry(models.Model):
     acts_ids = fields.One2many('clinic.cash_entry.line', 'entry_id', string='Actes',
                                copy=True, )
 
+    # montants et état du paiement : un seul calcul (_compute_amount) pour tout le lot
     tax_amount = fields.Monetary(string='Montant Taxe', compute='_compute_amount', readonly=True, store=True)
 
     montant = fields.Monetary(string='Montant HT', compute='_compute_amount', store=True, )
 
-    amount_total = fields.Monetary(string='Total', store=True, readonly=True, compute='_compute_amount_total', )
+    amount_total = fields.Monetary(string='Total', store=True, readonly=True, compute='_compute_amount', )
 
     amount_payed = fields.Monetary(string='Montant Payé', readonly=False, store=True, )
 
-    amount_residual = fields.Monetary(string='Reste à payer', store=True, compute='_compute_amount_residual')
+    amount_residual = fields.Monetary(string='Reste à payer', store=True, compute='_compute_amount')
 
     payment_ref = fields.Char(string='Référence de paiement')
 
@@ -119,106 +214,350 @@ class CashEntry(models.Model):
         ('Payé', 'Payé'),
         ('Partiellement payé', 'Partiellement payé'),
         ('Non payé', 'Non payé'),
-    ], string="État du paiement", store=True, readonly=True, copy=False, tracking=True,
+    ], string="État du paiement", compute='_compute_amount', store=True, readonly=True, copy=False, tracking=True,
     )
 
     supplement = fields.Boolean(default=False, string='Supplément')
 
     rest = fields.Boolean(default=False, string='Paiement du reste', store=True, )
 
-    previous_encaissement_id = fields.Many2one('clinic.cash_entry', string='Encaissement précédent', compute='_get_previous_encaissement',
-                                               store=True)
+    # paiement du reste : renseignés à la saisie (_onchange_rest) ; calculés, ils dépendraient du
+    # reste à payer du patient, lui-même reporté depuis les encaissements
+    previous_encaissement_id = fields.Many2one('clinic.cash_entry', string='Encaissement précédent', copy=False)
 
-    left_to_pay = fields.Monetary(string='Reste à régler', store=True, compute='_compute_left_to_pay')
+    left_to_pay = fields.Monetary(string='Reste à régler', copy=False)
 
     convention_dec = fields.Many2one(string='Convention', related='patient_id.convention_id')
+    # convention du patient en vigueur à la date de l'encaissement : payeur facturé et bordereaux
+    # s'y réfèrent, un changement ultérieur de convention du patient ne les affecte pas
+    convention_id = fields.Many2one('clinic.convention', string='Convention appliquée', readonly=True,
+                                    compute='_compute_convention_id', store=True, index='btree_not_null')
 
     state_dec = fields.Selection(string='État', related='patient_id.state')
 
     end_date_dec = fields.Date(string='Date de fin de convention', related='patient_id.end_date')
 
-    invoice_id = fields.Many2one('account.move', string='Facture', readonly=True, copy=False)
+    invoice_id = fields.Many2one('account.move', string='Facture', readonly=True, copy=False, index=True)
+    invoicing_run_id = fields.Many2one('clinic.invoicing.run', string='Facturation groupée', readonly=True,
+                                       copy=False, index='btree_not_null')
+
+    # Grand livre patient : montant actuellement reporté dans res.partner.total_rest
+    balance_posted = fields.Monetary(string='Reste reporté', readonly=True, copy=False)
+    balance_posted_partner_id = fields.Many2one('res.partner', string='Reporté sur', readonly=True, copy=False)
+    # montant actuellement reporté dans les totaux du relevé (clinic.cash_statement._post_statement_totals)
+    cash_posted = fields.Monetary(string='Montant reporté', readonly=True, copy=False)
+    cash_posted_statement_id = fields.Many2one('clinic.cash_statement', string='Reporté sur le relevé',
+                                               readonly=True, copy=False)
 
     def action_create_invoice(self):
         self.ensure_one()
         if self.invoice_id:
             raise UserError(_("Facture déjà créée."))
-
-        invoice_lines = []
-        for line in self.acts_ids:
-            invoice_lines.append((0, 0, {
-                'product_id': line.act_id.id,
-                'quantity': 1,
-                'price_unit': line.amount + line.tax_amount,
-                'tax_ids': [(6, 0, line.act_id.taxes_id.ids)],
-            }))
-
-        #  Création écriture
-        move = self.env['account.move'].create({
-            'move_type': 'out_invoice',
-            'partner_id': self.patient_id.id,
-            'invoice_date': self.date,
-            'journal_id': self.env['account.journal'].search(
-                [('type', '=', 'sale'), ('company_id', '=', self.env.company.id)], limit=1).id,
-            'invoice_line_ids': invoice_lines,
-            # 'cash_entry_id': self.id,  # lien retour
-        })
-        # move.action_post()  # comptabilise
-        self.invoice_id = move
-        return move
+        journal = self.env['account.journal'].search(
+            [('type', '=', 'sale'), ('company_id', '=', self.env.company.id)], limit=1)
+        return self._create_grouped_invoices(journal)
+
+    # ------------------------------------------------------------------ #
+    # Facturation                                                        #
+    # ------------------------------------------------------------------ #
+    @api.depends('patient_id', 'date')
+    def _compute_convention_id(self):
+        for entry in self:
+            patient = entry.patient_id
+            valid = patient.state == 'active' and (
+                not patient.end_date or not entry.date or patient.end_date >= entry.date)
+            entry.convention_id = patient.convention_id if valid else False
+
+    def _get_invoice_partner(self, group_by='patient'):
+        """Partenaire facturé : le patient, ou l'organisme payeur de la convention en vigueur à la date du bon."""
+        self.ensure_one()
+        if group_by == 'payer' and self.convention_id.partner_id:
+            return self.convention_id.partner_id
+        return self.patient_id
 
     @api.model
-    def create(self, vals):
-        if not vals.get('n_bon'):
-            vals['n_bon'] = self.env['ir.sequence'].next_by_code('clinic.cash_entry') or _('Nouveau')
-        return super(CashEntry, self).create(vals)
-
-    @api.depends('acts_ids', 'acts_ids.amount', 'amount_payed', 'acts_ids.tax', 'acts_ids.difference_amount', 'rest',
-                 'supplement')
-    def _compute_amount(self):
-        for statement in self:
-
-            statement.montant = sum([line.amount for line in statement.acts_ids])
-            statement.tax_amount = sum([line.tax_amount for line in statement.acts_ids])
-            if not statement.rest:
-                statement.amount_total = statement.montant + statement.tax_amount
-            elif not statement.supplement:
-                statement.amount_total = statement.left_to_pay
-            elif statement.rest and statement.supplement:
-
-                statement.amount_total = statement.left_to_pay + statement.montant + statement.tax_amount
-
-            statement.amount_residual = statement.amount_total - statement.amount_payed
+    def _get_unbilled_domain(self):
+        """
+        Encaissements encore à facturer (facture patient / payeur). Ceux dont des lignes sont
+        réclamées sur un bordereau le restent pour la part non réclamée (voir UNBILLED_ENTRY_SQL).
+        """
+        return [('invoice_id', '=', False)]
+
+    def _invoice_group_domain(self, group_by='patient'):
+        """Domaine couvrant tous les encaissements du patient, à facturer avec ceux-ci."""
+        return [('patient_id', 'in', self.patient_id.ids)]
+
+    def _invoice_group_key(self, group_by='patient'):
+        """Une facture par patient ; par payeur, une facture par organisme et par mois."""
+        self.ensure_one()
+        partner = self._get_invoice_partner(group_by)
+        if group_by == 'payer' and partner != self.patient_id:
+            return partner, self.date.replace(day=1)
+        return partner, False
 
-            if statement.amount_residual != 0 and statement.amount_payed != 0 and statement.amount_payed != statement.amount_total:
-                statement.payment_state = 'Partiellement payé'
-            elif statement.amount_payed == statement.amount_total and statement.amount_total != 0:
-                statement.payment_state = 'Payé'
-            elif statement.rest:
-                statement.payment_state = 'Payé'
-            elif statement.amount_payed == 0:
-                statement.payment_state = 'Non payé'
+    def _prepare_invoice_vals(self, partner, journal):
+        return {
+            'move_type': 'out_invoice',
+            'partner_id': partner.id,
+            'invoice_date': max(self.mapped('date')),
+            'journal_id': journal.id,
+            'invoice_origin': ', '.join(self.mapped('n_bon')),
+            'invoice_line_ids': [(0, 0, line._prepare_invoice_line_vals()) for line in self.acts_ids],
+        }
+
+    def _create_grouped_invoices(self, journal, group_by='patient'):
+        """Crée en une fois une facture par patient (ou payeur) pour les encaissements non facturés."""
+        entries = self.filtered(lambda e: not e.invoice_id and e.acts_ids)
+        groups = {}
+        for entry in entries:
+            key = entry._invoice_group_key(group_by)
+            groups[key] = groups.get(key, self.browse()) | entry
+        if not groups:
+            return self.env['account.move']
+        moves = self.env['account.move'].create([
+            group._prepare_invoice_vals(partner, journal) for (partner, __), group in groups.items()
+        ])
+        for move, group in zip(moves, groups.values()):
+            group.invoice_id = move
+        return moves
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [vals for vals in vals_list if not vals.get('n_bon')]
+        numbers = self.env['ir.sequence'].next_by_code_batch('clinic.cash_entry', len(to_number))
+        for vals, number in zip(to_number, numbers):
+            vals['n_bon'] = number or _('Nouveau')
+        entries = super(CashEntry, self).create(vals_list)
+        entries._mark_patient_balance()
+        self.env['clinic.cash_statement']._mark_statement_totals(entries)
+        return entries
+
+    def write(self, vals):
+        result = super().write(vals)
+        self._mark_patient_balance()
+        self.env['clinic.cash_statement']._mark_statement_totals(self)
+        if 'doctor_id' in vals or 'date' in vals:
+            # médecin et date des lignes sont des champs liés, recalculés sans passer par leur write
+            self.env['clinic.doctor.ledger']._mark_pending(self.acts_ids)
+        return result
+
+    def unlink(self):
+        # retirer du reste à payer des patients ce qui y avait été reporté
+        self.env.cr.execute("""
+            UPDATE res_partner p
+               SET total_rest = COALESCE(p.total_rest, 0) - d.amount
+              FROM (SELECT balance_posted_partner_id AS partner_id, SUM(balance_posted) AS amount
+                      FROM clinic_cash_entry
+                     WHERE id = ANY(%s) AND balance_posted_partner_id IS NOT NULL
+                  GROUP BY balance_posted_partner_id) d
+             WHERE p.id = d.partner_id
+        """, [self.ids])
+        self.env['res.partner'].invalidate_model(['total_rest'])
+        self.env['clinic.cash_statement']._post_statement_totals(self._name, self.ids, reverse_only=True)
+        return super().unlink()
+
+    def init(self):
+        # Initialisation du grand livre patient pour les encaissements jamais reportés
+        self.env.cr.execute("""
+            SELECT 1 FROM clinic_cash_entry
+             WHERE balance_posted_partner_id IS NULL AND patient_id IS NOT NULL
+             LIMIT 1
+        """)
+        if self.env.cr.fetchone():
+            self._rebuild_patient_balances()
+
+    # ------------------------------------------------------------------ #
+    # Grand livre patient                                                #
+    # ------------------------------------------------------------------ #
+    def _mark_patient_balance(self):
+        """Programme le report des encaissements dans le reste à payer patient, une fois par transaction."""
+        pending = self.env.cr.precommit.data.setdefault('clinic.patient_balance', set())
+        if not pending:
+            self.env.cr.precommit.add(self._flush_patient_balance)
+        pending.update(self.ids)
 
+    @api.model
+    def _flush_patient_balance(self):
+        entry_ids = self.env.cr.precommit.data.pop('clinic.patient_balance', set())
+        if entry_ids:
+            self._post_patient_balance(list(entry_ids))
 
-    @api.depends('acts_ids', 'acts_ids.amount', 'acts_ids.tax_amount')
-    def _compute_amount_total(self):
-        for record in self:
-            record.amount_total = sum(line.amount + line.tax_amount for line in record.acts_ids)
+    @api.model
+    def _post_patient_balance(self, entry_ids):
+        """Reporte par delta la part de chaque encaissement dans res.partner.total_rest."""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            WITH changed AS (
+                SELECT e.id, e.patient_id, {balance} AS amount,
+                       e.balance_posted, e.balance_posted_partner_id
+                  FROM clinic_cash_entry e
+                 WHERE e.id = ANY(%s)
+                   FOR UPDATE
+            ), deltas AS (
+                SELECT partner_id, SUM(delta) AS delta FROM (
+                    SELECT patient_id AS partner_id, amount AS delta FROM changed
+                     UNION ALL
+                    SELECT balance_posted_partner_id, -COALESCE(balance_posted, 0)
+                      FROM changed WHERE balance_posted_partner_id IS NOT NULL
+                ) moves
+                GROUP BY partner_id
+            ), posted AS (
+                UPDATE clinic_cash_entry e
+                   SET balance_posted = c.amount, balance_posted_partner_id = c.patient_id
+                  FROM changed c
+                 WHERE e.id = c.id
+            )
+            UPDATE res_partner p
+               SET total_rest = COALESCE(p.total_rest, 0) + d.delta
+              FROM deltas d
+             WHERE p.id = d.partner_id AND d.delta != 0
+        """.format(balance=PATIENT_BALANCE_SQL), [entry_ids])
+        self.invalidate_model(['balance_posted', 'balance_posted_partner_id'])
+        self.env['res.partner'].invalidate_model(['total_rest'])
 
-    @api.depends('amount_total', 'amount_payed')
-    def _compute_amount_residual(self):
-        for record in self:
-            record.amount_residual = record.amount_total - record.amount_payed
+    @api.model
+    def _rebuild_patient_balances(self):
+        """Recalcule entièrement le grand livre patient (initialisation ou réparation)."""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE clinic_cash_entry e
+               SET balance_posted = {balance}, balance_posted_partner_id = e.patient_id
+        """.format(balance=PATIENT_BALANCE_SQL))
+        self.env.cr.execute("UPDATE res_partner SET total_rest = 0 WHERE total_rest IS NULL OR total_rest != 0")
+        self.env.cr.execute("""
+            UPDATE res_partner p
+               SET total_rest = d.amount
+              FROM (SELECT balance_posted_partner_id AS partner_id, SUM(balance_posted) AS amount
+                      FROM clinic_cash_entry
+                     WHERE balance_posted_partner_id IS NOT NULL
+                  GROUP BY balance_posted_partner_id) d
+             WHERE p.id = d.partner_id
+        """)
+        self.invalidate_model(['balance_posted', 'balance_posted_partner_id'])
+        self.env['res.partner'].invalidate_model(['total_rest'])
 
-    @api.depends('amount_residual')
-    def _compute_payment_state(self):
-        for record in self:
-            if record.amount_residual <= 0:
-                record.payment_state = 'Payé'
-            elif record.amount_payed > 0:
-                record.payment_state = 'Partiellement payé'
+    @api.model
+    def get_financial_kpis(self, date_from=None, date_to=None, today=None):
+        """
+        Indicateurs financiers des encaissements calculés en une seule requête agrégée :
+        totaux, délai moyen de paiement des bons impayés, répartition par état de paiement
+        et chiffre d'affaires par médecin.
+        """
+        self.flush_model(['date', 'doctor_id', 'payment_state', 'amount_total',
+                          'amount_payed', 'amount_residual'])
+        today = today or fields.Date.context_today(self)
+
+        domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        # droits d'accès et règles (société, groupes) de l'utilisateur appliqués par _search
+        query = self._search(domain)
+
+        self.env.cr.execute(SQL("""
+            SELECT GROUPING(e.payment_state) AS g_state,
+                   GROUPING(e.doctor_id) AS g_doctor,
+                   e.payment_state,
+                   e.doctor_id,
+                   MAX(p.name) AS doctor_name,
+                   COUNT(*) AS count,
+                   COALESCE(SUM(e.amount_total), 0) AS amount_total,
+                   COALESCE(SUM(e.amount_payed), 0) AS amount_payed,
+                   COALESCE(SUM(e.amount_residual), 0) AS amount_residual,
+                   AVG(%s - e.date) FILTER (
+                       WHERE e.amount_residual > 0
+                         AND e.payment_state IN ('Non payé', 'Partiellement payé')
+                   ) AS avg_payment_delay
+              FROM clinic_cash_entry e
+         LEFT JOIN res_partner p ON p.id = e.doctor_id
+             WHERE e.id IN %s
+          GROUP BY GROUPING SETS ((), (e.payment_state), (e.doctor_id))
+        """, today, query.subselect()))
+
+        kpis = {
+            'count': 0,
+            'amount_total': 0.0,
+            'amount_payed': 0.0,
+            'amount_residual': 0.0,
+            'avg_payment_delay': 0,
+            'by_payment_state': [],
+            'revenue_by_doctor': [],
+        }
+        for row in self.env.cr.dictfetchall():
+            if row['g_state'] and row['g_doctor']:
+                kpis.update({
+                    'count': row['count'],
+                    'amount_total': row['amount_total'],
+                    'amount_payed': row['amount_payed'],
+                    'amount_residual': row['amount_residual'],
+                    'avg_payment_delay': float(row['avg_payment_delay'] or 0),
+                })
+            elif not row['g_state']:
+                kpis['by_payment_state'].append({
+                    'state': row['payment_state'] or False,
+                    'count': row['count'],
+                    'amount_residual': row['amount_residual'],
+                })
+            elif row['doctor_id']:
+                kpis['revenue_by_doctor'].append({
+                    'doctor_id': row['doctor_id'],
+                    'doctor': row['doctor_name'],
+                    'total': row['amount_total'],
+                })
+        return kpis
+
+    @api.depends('acts_ids.amount', 'acts_ids.tax_amount', 'amount_payed', 'rest', 'supplement', 'left_to_pay')
+    def _compute_amount(self):
+        # sommes de toutes les lignes du lot en un seul parcours
+        totals = {entry: [0.0, 0.0] for entry in self}
+        for line in self.acts_ids:
+            amounts = totals.get(line.entry_id)
+            if amounts is not None:
+                amounts[0] += line.amount
+                amounts[1] += line.tax_amount
+
+        for entry in self:
+            montant, tax_amount = totals[entry]
+            if not entry.rest:
+                amount_total = montant + tax_amount
+            elif not entry.supplement:
+                amount_total = entry.left_to_pay
+            else:
+                amount_total = entry.left_to_pay + montant + tax_amount
+            amount_residual = amount_total - entry.amount_payed
+
+            if amount_residual != 0 and entry.amount_payed != 0 and entry.amount_payed != amount_total:
+                payment_state = 'Partiellement payé'
+            elif entry.amount_payed == amount_total and amount_total != 0:
+                payment_state = 'Payé'
+            elif entry.rest:
+                payment_state = 'Payé'
+            else:
+                payment_state = 'Non payé'
+
+            entry.update({
+                'montant': montant,
+                'tax_amount': tax_amount,
+                'amount_total': amount_total,
+                'amount_residual': amount_residual,
+                'payment_state': payment_state,
+            })
+
+    @api.onchange('patient_id', 'rest')
+    def _onchange_rest(self):
+        """Paiement du reste : reprend le reste à payer du patient et son dernier encaissement non soldé."""
+        for entry in self:
+            if entry.rest and entry.patient_id:
+                entry.left_to_pay = entry.patient_id.total_rest
+                entry.previous_encaissement_id = self.search([
+                    ('patient_id', '=', entry.patient_id.id),
+                    ('amount_residual', '>', 0),
+                    ('id', '!=', entry._origin.id),
+                ], order='date desc, id desc', limit=1)
             else:
-                record.payment_state = 'Non payé'
+                entry.left_to_pay = 0
+                entry.previous_encaissement_id = False
 
     @api.constrains('statement_id', 'payment_state')
     def _check_statement_state(self):
@@ -244,8 +583,10 @@ class CashEntryLine(models.Model):
         required=True,
     )
 
-    entry_id = fields.Many2one('clinic.cash_entry', string='Encaissement', required=True, ondelete='cascade')
-    act_id = fields.Many2one('product.product', string='Acte', domain="[('is_medical_act', '=', True)]", required=True)
+    entry_id = fields.Many2one('clinic.cash_entry', string='Encaissement', required=True, ondelete='cascade',
+                               index=True)
+    act_id = fields.Many2one('product.product', string='Acte', domain="[('is_medical_act', '=', True)]", required=True,
+                             index=True)
 
     amount = fields.Float(string='Montant', compute='_compute_amount', store=True)
 
@@ -270,11 +611,12 @@ class CashEntryLine(models.Model):
 
     date_dec = fields.Date(string='Date', related='entry_id.date', store=True)
 
-    designation_dec = fields.Char(string='Désignation', related='act_id.name', store=True)
+    # recopiés du catalogue au choix de l'acte ; un renommage est propagé en différé (clinic.catalog.resync)
+    designation_dec = fields.Char(string='Désignation', compute='_compute_catalog_dec', store=True)
 
     patient_id_dec = fields.Many2one(related='entry_id.patient_id', string='Patient', store=True)
 
-    family_id_dec = fields.Many2one(related='act_id.categ_id', string='Famille', store=True)
+    family_id_dec = fields.Many2one('product.category', string='Famille', compute='_compute_catalog_dec', store=True)
 
     n_bon_dec = fields.Char(related='entry_id.n_bon', string='N° Bon', store=True)
 
@@ -282,6 +624,57 @@ class CashEntryLine(models.Model):
 
     per_cpart = fields.Float('% Quote-part', )
 
+    # dernière quote-part reportée dans les relevés médecin (clinic.doctor.ledger._post_moves)
+    cote_posted = fields.Monetary(string='Quote-part reportée', readonly=True, copy=False)
+    cote_posted_doctor_id = fields.Many2one('res.partner', string='Médecin reporté', readonly=True, copy=False)
+    cote_posted_period = fields.Date(string='Période reportée', readonly=True, copy=False)
+
+    # réclamation auprès de l'organisme payeur (clinic.claim.batch.action_compute)
+    claim_batch_id = fields.Many2one('clinic.claim.batch', string='Bordereau', readonly=True, copy=False,
+                                     index='btree_not_null')
+    claim_amount = fields.Monetary(string='Part organisme', readonly=True, copy=False)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.entry_id._mark_patient_balance()
+        self.env['clinic.cash_statement']._mark_statement_totals(lines.entry_id)
+        self.env['clinic.doctor.ledger']._mark_pending(lines)
+        return lines
+
+    def write(self, vals):
+        entries = self.entry_id
+        result = super().write(vals)
+        (entries | self.entry_id)._mark_patient_balance()
+        self.env['clinic.cash_statement']._mark_statement_totals(entries | self.entry_id)
+        self.env['clinic.doctor.ledger']._mark_pending(self)
+        return result
+
+    def unlink(self):
+        self.entry_id._mark_patient_balance()
+        self.env['clinic.cash_statement']._mark_statement_totals(self.entry_id)
+        self.env['clinic.doctor.ledger']._post_moves(self._name, self.ids, reverse_only=True)
+        return super().unlink()
+
+    def _prepare_invoice_line_vals(self):
+        """Ligne de facture de l'acte, déduction faite de la part réclamée à l'organisme sur un bordereau."""
+        self.ensure_one()
+        name = '%s - %s' % (self.entry_id.n_bon, self.act_id.display_name)
+        if self.claim_batch_id:
+            name = _("%s (part organisme %s : %s)", name, self.claim_batch_id.name, self.claim_amount)
+        return {
+            'product_id': self.act_id.id,
+            'name': name,
+            'quantity': 1,
+            'price_unit': self.amount + self.tax_amount - self.claim_amount,
+            'tax_ids': [(6, 0, self.act_id.taxes_id.ids)],
+        }
+
+    @api.depends('act_id')
+    def _compute_catalog_dec(self):
+        for line in self:
+            line.designation_dec = line.act_id.name
+            line.family_id_dec = line.act_id.categ_id
 
     @api.onchange('doctor_id_dec')
     def cote_value(self):
@@ -305,12 +698,21 @@ class CashEntryLine(models.Model):
 
     @api.depends('rate_type', 'act_id', 'tax', 'difference_amount')
     def _compute_amount(self):
+        # prix conventionnés lus une fois par grille depuis la matrice en cache
+        convention_prices = {}
+        convention_lines = self.filtered(
+            lambda l: l.rate_type == 'Tarif Convention ' and l.entry_id.convention_dec)
+        for pricelist in convention_lines.entry_id.convention_dec.pricelist_id:
+            acts = convention_lines.filtered(
+                lambda l: l.entry_id.convention_dec.pricelist_id == pricelist).act_id
+            convention_prices[pricelist.id] = self.env['clinic.convention']._get_act_prices(pricelist, acts)
+
         for line in self:
             price = 0.0
 
             if line.rate_type == 'Tarif Convention ' and line.entry_id.convention_dec:
                 pricelist = line.entry_id.convention_dec.pricelist_id
-                price = pricelist._get_product_price(line.act_id, 1.0)
+                price = convention_prices[pricelist.id].get(line.act_id.id, 0.0)
 
             else:
                 price = line.act_id.list_price
@@ -351,12 +753,102 @@ class CashExit(models.Model):
     currency_id = fields.Many2one('res.currency', string='Devise', default=lambda self: self.env.company.currency_id)
     note = fields.Text(string='Remarques')
 
+    # dernière quote-part reportée dans les relevés médecin (clinic.doctor.ledger._post_moves)
+    cote_posted = fields.Monetary(string='Quote-part reportée', readonly=True, copy=False)
+    cote_posted_doctor_id = fields.Many2one('res.partner', string='Médecin reporté', readonly=True, copy=False)
+    cote_posted_period = fields.Date(string='Période reportée', readonly=True, copy=False)
+
+    # montant actuellement reporté dans les totaux du relevé (clinic.cash_statement._post_statement_totals)
+    cash_posted = fields.Monetary(string='Montant reporté', readonly=True, copy=False)
+    cash_posted_statement_id = fields.Many2one('clinic.cash_statement', string='Reporté sur le relevé',
+                                               readonly=True, copy=False)
+
     def print_bon_d(self):
         return self.env.ref('clinic.report_decaissement').report_action(self)
 
-    @api.model
-    def create(self, vals):
-        if not vals.get('n_bon'):
-            vals['n_bon'] = self.env['ir.sequence'].next_by_code('clinic.cash_exit') or _('Nouveau')
-        return super(CashExit, self).create(vals)
-
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [vals for vals in vals_list if not vals.get('n_bon')]
+        numbers = self.env['ir.sequence'].next_by_code_batch('clinic.cash_exit', len(to_number))
+        for vals, number in zip(to_number, numbers):
+            vals['n_bon'] = number or _('Nouveau')
+        exits = super(CashExit, self).create(vals_list)
+        self.env['clinic.doctor.ledger']._mark_pending(exits)
+        self.env['clinic.cash_statement']._mark_statement_totals(exits)
+        return exits
+
+    def write(self, vals):
+        result = super().write(vals)
+        self.env['clinic.doctor.ledger']._mark_pending(self)
+        self.env['clinic.cash_statement']._mark_statement_totals(self)
+        return result
+
+    def unlink(self):
+        self.env['clinic.doctor.ledger']._post_moves(self._name, self.ids, reverse_only=True)
+        self.env['clinic.cash_statement']._post_statement_totals(self._name, self.ids, reverse_only=True)
+        return super().unlink()
+
+    def init(self):
+        # Initialisation des totaux de relevé (une fois les tables des encaissements et décaissements prêtes)
+        self.env.cr.execute("""
+            SELECT 1 FROM clinic_cash_entry WHERE cash_posted_statement_id IS NULL
+             UNION ALL
+            SELECT 1 FROM clinic_cash_exit WHERE cash_posted_statement_id IS NULL
+             LIMIT 1
+        """)
+        if self.env.cr.fetchone():
+            self.env['clinic.cash_statement']._rebuild_statement_totals()
+        # Initialisation des relevés médecin pour les quotes-parts jamais reportées ; ici, et non
+        # dans clinic.cash_entry.line, pour que les colonnes cote_posted des décaissements existent
+        self.env.cr.execute("""
+            SELECT 1 FROM clinic_cash_entry_line
+             WHERE cote_posted_doctor_id IS NULL AND doctor_id_dec IS NOT NULL
+             LIMIT 1
+        """)
+        if self.env.cr.fetchone():
+            self.env['clinic.doctor.ledger']._rebuild()
+
+
+class RevenueByService(models.Model):
+    _name = 'clinic.report.revenue.service'
+    _description = 'Chiffre d\'affaires par service'
+    _auto = False  # pas de table créée, on lit la vue
+    _rec_name = 'service_id'
+    _order = 'day desc'
+
+    day = fields.Date(string='Jour', readonly=True)
+    service_id = fields.Many2one('clinic.service', string='Service', readonly=True)
+    doctor_id = fields.Many2one('res.partner', string='Médecin', readonly=True)
+    family_id = fields.Many2one('product.category', string='Famille', readonly=True)
+    line_count = fields.Integer(string='Nombre d\'actes', readonly=True)
+    amount = fields.Float(string='Montant HT', readonly=True)
+    tax_amount = fields.Float(string='Montant Taxe', readonly=True)
+    total = fields.Float(string='Total', readonly=True)
+
+    def init(self):
+        # Le service vient de la consultation, à défaut du rendez-vous rattaché au bon
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW clinic_report_revenue_service AS (
+                SELECT
+                    ROW_NUMBER() OVER () AS id,
+                    e.date AS day,
+                    COALESCE(enc.service_id, rdv.service_id) AS service_id,
+                    e.doctor_id AS doctor_id,
+                    l.family_id_dec AS family_id,
+                    COUNT(*) AS line_count,
+                    SUM(l.amount) AS amount,
+                    SUM(l.tax_amount) AS tax_amount,
+                    SUM(l.amount + l.tax_amount) AS total
+                FROM clinic_cash_entry_line l
+                JOIN clinic_cash_entry e ON e.id = l.entry_id
+                LEFT JOIN LATERAL (
+                    SELECT a.service_id, a.encounter_id
+                    FROM clinic_appointment a
+                    WHERE a.bon_id = e.id
+                    ORDER BY a.id
+                    LIMIT 1
+                ) rdv ON TRUE
+                LEFT JOIN clinic_encounter enc ON enc.id = rdv.encounter_id
+                GROUP BY e.date, COALESCE(enc.service_id, rdv.service_id), e.doctor_id, l.family_id_dec
+            )
+        """)
@@ -0,0 +1,82 @@
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class CatalogResync(models.Model):
+    """
+    Propagation différée d'une modification du catalogue (nom ou famille d'un acte) vers les
+    colonnes recopiées des lignes d'encaissement, par paquets validés un à un.
+    """
+    _name = 'clinic.catalog.resync'
+    _description = 'Mise à jour différée des lignes après modification du catalogue'
+    _order = 'id desc'
+    _rec_name = 'act_id'
+
+    act_id = fields.Many2one('product.product', string='Acte', required=True, readonly=True, ondelete='cascade')
+    state = fields.Selection([
+        ('pending', 'En attente'),
+        ('done', 'Terminé'),
+    ], string='État', default='pending', required=True, readonly=True, index=True)
+    line_total = fields.Integer(string='Lignes à mettre à jour', readonly=True)
+    line_done = fields.Integer(string='Lignes mises à jour', readonly=True)
+    progress = fields.Float(string='Progression', compute='_compute_progress')
+    date_done = fields.Datetime(string='Terminé le', readonly=True)
+
+    @api.depends('line_total', 'line_done')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            else:
+                job.progress = 100.0 * job.line_done / job.line_total if job.line_total else 0.0
+
+    @api.model
+    def _enqueue(self, acts):
+        """Programme la mise à jour des lignes des actes ; la modification du catalogue rend la main aussitôt."""
+        if not acts:
+            return
+        pending = self.search([('act_id', 'in', acts.ids), ('state', '=', 'pending')])
+        # un travail déjà en attente reprendra les nouvelles valeurs
+        pending.write({'line_total': 0, 'line_done': 0})
+        self.create([{'act_id': act.id} for act in acts - pending.act_id])
+        self.env.ref('clinic.cron_catalog_resync')._trigger()
+
+    @api.model
+    def _cron_process(self):
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param('clinic.catalog_resync_chunk_size', 5000))
+        for job in self.search([('state', '=', 'pending')], order='id'):
+            job._process(chunk_size)
+
+    def _process(self, chunk_size):
+        """Met à jour les lignes de l'acte par paquets de `chunk_size`, avec un commit par paquet."""
+        self.ensure_one()
+        act = self.act_id
+        name, categ_id = act.name, act.categ_id.id or None
+        if not self.line_total:
+            self.env.cr.execute("SELECT COUNT(*) FROM clinic_cash_entry_line WHERE act_id = %s", [act.id])
+            self.line_total = self.env.cr.fetchone()[0]
+            self.env.cr.commit()
+        while True:
+            self.env.cr.execute("""
+                UPDATE clinic_cash_entry_line
+                   SET designation_dec = %(name)s, family_id_dec = %(categ_id)s
+                 WHERE id IN (
+                        SELECT id FROM clinic_cash_entry_line
+                         WHERE act_id = %(act_id)s
+                           AND (designation_dec IS DISTINCT FROM %(name)s
+                                OR family_id_dec IS DISTINCT FROM %(categ_id)s)
+                         LIMIT %(limit)s
+                 )
+            """, {'act_id': act.id, 'name': name, 'categ_id': categ_id, 'limit': chunk_size})
+            updated = self.env.cr.rowcount
+            if not updated:
+                break
+            self.line_done = min(self.line_done + updated, self.line_total)
+            self.env.cr.commit()
+        self.write({'state': 'done', 'line_done': self.line_total, 'date_done': fields.Datetime.now()})
+        self.env['clinic.cash_entry.line'].invalidate_model(['designation_dec', 'family_id_dec'])
+        self.env.cr.commit()
+        _logger.info("Catalog resync of act %s: %s lines", act.id, self.line_total)
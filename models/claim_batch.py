@@ -0,0 +1,240 @@
+import csv
+import io
+import tempfile
+from xml.sax.saxutils import XMLGenerator
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from .cash import UNBILLED_ENTRY_SQL
+
+# Lignes conventionnées d'un bordereau, dans l'ordre du fichier de réclamation
+CLAIM_LINES_SQL = """
+    SELECT l.id, e.n_bon, e.date, p.name, p.num_carte_chifa, p.patient_sequance,
+           pp.code, l.designation_dec, l.amount, l.claim_amount
+      FROM clinic_cash_entry_line l
+      JOIN clinic_cash_entry e ON e.id = l.entry_id
+      JOIN res_partner p ON p.id = e.patient_id
+      JOIN product_product pp ON pp.id = l.act_id
+     WHERE l.claim_batch_id = %(batch_id)s AND l.id > %(last_id)s
+  ORDER BY l.id
+     LIMIT %(limit)s
+"""
+
+CLAIM_COLUMNS = ['n_bon', 'date', 'patient', 'num_carte_chifa', 'identifiant', 'code_acte', 'acte',
+                 'tarif', 'part_organisme']
+
+
+class ClaimBatch(models.Model):
+    _name = 'clinic.claim.batch'
+    _description = 'Bordereau de réclamation convention'
+    _inherit = ['mail.thread']
+    _order = 'date_to desc, id desc'
+
+    name = fields.Char(string='Référence', readonly=True, copy=False, default=lambda self: _('Nouveau'))
+    convention_id = fields.Many2one('clinic.convention', string='Convention', required=True, tracking=True)
+    date_from = fields.Date(string='Du', required=True)
+    date_to = fields.Date(string='Au', required=True)
+    state = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('computed', 'Calculé'),
+        ('invoiced', 'Facturé'),
+    ], string='État', default='draft', readonly=True, copy=False, tracking=True)
+    currency_id = fields.Many2one('res.currency', string='Devise', default=lambda self: self.env.company.currency_id)
+    line_count = fields.Integer(string='Nombre de lignes', readonly=True, copy=False)
+    amount_total = fields.Monetary(string='Part organisme', readonly=True, copy=False)
+    invoice_id = fields.Many2one('account.move', string='Facture', readonly=True, copy=False)
+    file_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('xml', 'XML'),
+    ], string='Format du fichier', default='csv', required=True)
+    claim_file = fields.Binary(string='Fichier de réclamation', readonly=True, attachment=True, copy=False)
+    claim_filename = fields.Char(string='Nom du fichier', readonly=True, copy=False)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [vals for vals in vals_list if vals.get('name', _('Nouveau')) == _('Nouveau')]
+        numbers = self.env['ir.sequence'].next_by_code_batch('clinic.claim.batch', len(to_number))
+        for vals, number in zip(to_number, numbers):
+            vals['name'] = number or _('Nouveau')
+        return super(ClaimBatch, self).create(vals_list)
+
+    def unlink(self):
+        if any(batch.state == 'invoiced' for batch in self):
+            raise UserError(_("Un bordereau facturé ne peut pas être supprimé."))
+        self._release_lines()
+        return super().unlink()
+
+    # ------------------------------------------------------------------ #
+    # Calcul                                                             #
+    # ------------------------------------------------------------------ #
+    def action_compute(self):
+        """
+        Rattache au bordereau, en une seule requête, les lignes au tarif convention de la période
+        non encore réclamées, et calcule la part de l'organisme de chacune. Seuls les encaissements
+        passés sous cette convention (à leur date) et non encore facturés sont retenus ; leur facture
+        ultérieure ne reprendra que la part non réclamée.
+        """
+        self.env['clinic.cash_entry'].flush_model(['convention_id', 'invoice_id', 'date'])
+        self.env.flush_all()
+        for batch in self:
+            if batch.state != 'draft':
+                raise UserError(_("Le bordereau %s a déjà été calculé.", batch.name))
+            self.env.cr.execute("""
+                WITH claimed AS (
+                    UPDATE clinic_cash_entry_line l
+                       SET claim_batch_id = %(batch_id)s,
+                           claim_amount = ROUND((COALESCE(l.amount, 0) - COALESCE(l.difference_amount, 0))
+                                                * %(coverage_rate)s / 100.0, 2)
+                      FROM clinic_cash_entry e
+                     WHERE e.id = l.entry_id
+                       AND e.convention_id = %(convention_id)s
+                       AND l.rate_type = 'Tarif Convention '
+                       AND l.claim_batch_id IS NULL
+                       AND e.date BETWEEN %(date_from)s AND %(date_to)s
+                       AND {unbilled}
+                 RETURNING l.claim_amount
+                )
+                SELECT COUNT(*), COALESCE(SUM(claim_amount), 0) FROM claimed
+            """.format(unbilled=UNBILLED_ENTRY_SQL), {
+                'batch_id': batch.id,
+                'convention_id': batch.convention_id.id,
+                'coverage_rate': batch.convention_id.coverage_rate,
+                'date_from': batch.date_from,
+                'date_to': batch.date_to,
+            })
+            line_count, amount_total = self.env.cr.fetchone()
+            batch.write({'line_count': line_count, 'amount_total': amount_total, 'state': 'computed'})
+            batch._generate_claim_file()
+        self.env['clinic.cash_entry.line'].invalidate_model(['claim_batch_id', 'claim_amount'])
+
+    def action_reset(self):
+        for batch in self:
+            if batch.state == 'invoiced':
+                raise UserError(_("Le bordereau %s est déjà facturé.", batch.name))
+        self._release_lines()
+        self.write({'state': 'draft', 'line_count': 0, 'amount_total': 0,
+                    'claim_file': False, 'claim_filename': False})
+
+    def _release_lines(self):
+        if not self.ids:
+            return
+        # la facture du patient a déjà déduit la part réclamée : la libérer la laisserait impayée
+        invoiced = self.env['clinic.cash_entry.line'].search(
+            [('claim_batch_id', 'in', self.ids), ('entry_id.invoice_id', '!=', False)], limit=1)
+        if invoiced:
+            raise UserError(_("Le bon %s du bordereau %s est déjà facturé au patient, part organisme déduite.",
+                              invoiced.entry_id.n_bon, invoiced.claim_batch_id.name))
+        self.env.cr.execute("""
+            UPDATE clinic_cash_entry_line SET claim_batch_id = NULL, claim_amount = 0
+             WHERE claim_batch_id = ANY(%s)
+        """, [self.ids])
+        self.env['clinic.cash_entry.line'].invalidate_model(['claim_batch_id', 'claim_amount'])
+
+    # ------------------------------------------------------------------ #
+    # Facture consolidée                                                 #
+    # ------------------------------------------------------------------ #
+    def action_create_invoice(self):
+        """Une facture par bordereau, adressée à l'organisme payeur, avec une ligne par acte."""
+        journal = self.env['account.journal'].search(
+            [('type', '=', 'sale'), ('company_id', '=', self.env.company.id)], limit=1)
+        vals_list = []
+        for batch in self:
+            if batch.state != 'computed':
+                raise UserError(_("Le bordereau %s doit être calculé avant d'être facturé.", batch.name))
+            if not batch.convention_id.partner_id:
+                raise UserError(_("Aucun organisme payeur n'est défini sur la convention %s.",
+                                  batch.convention_id.name))
+            # prix conventionné unitaire de l'acte, le taux de prise en charge en remise sur la ligne
+            self.env.cr.execute("""
+                SELECT act_id, COALESCE(amount, 0) - COALESCE(difference_amount, 0) AS price_unit, COUNT(*)
+                  FROM clinic_cash_entry_line
+                 WHERE claim_batch_id = %s
+              GROUP BY act_id, price_unit
+              ORDER BY act_id, price_unit
+            """, [batch.id])
+            coverage_rate = batch.convention_id.coverage_rate
+            vals_list.append({
+                'move_type': 'out_invoice',
+                'partner_id': batch.convention_id.partner_id.id,
+                'invoice_date': batch.date_to,
+                'journal_id': journal.id,
+                'invoice_origin': batch.name,
+                'invoice_line_ids': [(0, 0, {
+                    'product_id': act_id,
+                    'quantity': quantity,
+                    'price_unit': price_unit,
+                    'discount': 100.0 - coverage_rate,
+                    'tax_ids': [(5, 0, 0)],
+                }) for act_id, price_unit, quantity in self.env.cr.fetchall()],
+            })
+        moves = self.env['account.move'].create(vals_list)
+        for batch, move in zip(self, moves):
+            batch.write({'invoice_id': move.id, 'state': 'invoiced'})
+        return moves
+
+    # ------------------------------------------------------------------ #
+    # Fichier de réclamation                                             #
+    # ------------------------------------------------------------------ #
+    def _iter_claim_lines(self, chunk_size=5000):
+        """Parcourt les lignes du bordereau par paquets, sans les charger en mémoire ni dans l'ORM."""
+        self.ensure_one()
+        last_id = 0
+        while True:
+            self.env.cr.execute(CLAIM_LINES_SQL, {'batch_id': self.id, 'last_id': last_id, 'limit': chunk_size})
+            rows = self.env.cr.fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_id = rows[-1][0]
+
+    def _generate_claim_file(self):
+        self.ensure_one()
+        with tempfile.TemporaryFile() as claim_file:
+            if self.file_format == 'xml':
+                self._write_claim_xml(claim_file)
+            else:
+                self._write_claim_csv(claim_file)
+            claim_file.seek(0)
+            # pièce jointe du champ écrite en binaire brut, sans la copie encodée en base64
+            Attachment = self.env['ir.attachment'].sudo()
+            Attachment.search([('res_model', '=', self._name), ('res_field', '=', 'claim_file'),
+                               ('res_id', '=', self.id)]).unlink()
+            Attachment.create({
+                'name': 'claim_file',
+                'res_model': self._name,
+                'res_field': 'claim_file',
+                'res_id': self.id,
+                'type': 'binary',
+                'raw': claim_file.read(),
+            })
+        self.invalidate_recordset(['claim_file'])
+        self.claim_filename = '%s.%s' % (self.name.replace('/', '_'), self.file_format)
+
+    def _write_claim_csv(self, claim_file):
+        stream = io.TextIOWrapper(claim_file, encoding='utf-8', newline='', write_through=True)
+        writer = csv.writer(stream, delimiter=';')
+        writer.writerow(CLAIM_COLUMNS)
+        for row in self._iter_claim_lines():
+            writer.writerow(['' if value is None else value for value in row])
+        stream.detach()
+
+    def _write_claim_xml(self, claim_file):
+        xml = XMLGenerator(claim_file, encoding='utf-8')
+        xml.startDocument()
+        xml.startElement('bordereau', {
+            'reference': self.name,
+            'convention': self.convention_id.name or '',
+            'du': str(self.date_from),
+            'au': str(self.date_to),
+        })
+        for row in self._iter_claim_lines():
+            xml.startElement('ligne', {})
+            for column, value in zip(CLAIM_COLUMNS, row):
+                xml.startElement(column, {})
+                xml.characters('' if value is None else str(value))
+                xml.endElement(column)
+            xml.endElement('ligne')
+        xml.endElement('bordereau')
+        xml.endDocument()
@@ -0,0 +1,216 @@
+import csv
+import logging
+from bisect import bisect_left
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+
+from .hc_base import ensure_pg_trgm
+
+_logger = logging.getLogger(__name__)
+
+CODE_SYSTEMS = [
+    ('loinc', 'LOINC'),
+    ('icd10', 'CIM-10'),
+]
+
+# Colonnes (code, libellé) des tables publiques au format CSV : Loinc.csv et table CIM-10 code;libellé
+CODE_FILE_COLUMNS = {
+    'loinc': ('LOINC_NUM', 'LONG_COMMON_NAME'),
+    'icd10': ('code', 'description'),
+}
+
+# Insère ou met à jour un paquet de codes en une requête ; les libellés inchangés ne sont pas réécrits
+UPSERT_CODES_SQL = """
+    INSERT INTO clinic_clinical_code (system, code, name, active, create_uid, create_date, write_uid, write_date)
+    SELECT %(system)s, c.code, c.name, TRUE, %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+      FROM UNNEST(%(codes)s::varchar[], %(names)s::varchar[]) AS c(code, name)
+    ON CONFLICT (system, code) DO UPDATE
+       SET name = EXCLUDED.name, active = TRUE, write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+     WHERE clinic_clinical_code.name IS DISTINCT FROM EXCLUDED.name OR NOT clinic_clinical_code.active
+"""
+
+
+class ClinicalCode(models.Model):
+    _name = 'clinic.clinical.code'
+    _description = 'Code clinique (LOINC, CIM-10)'
+    _order = 'system, code'
+    _rec_names_search = ['code', 'name']
+
+    system = fields.Selection(CODE_SYSTEMS, string='Nomenclature', required=True, index=True)
+    code = fields.Char(string='Code', required=True)
+    name = fields.Char(string='Libellé', required=True)
+    active = fields.Boolean(string='Actif', default=True)
+
+    _sql_constraints = [
+        ('code_unique', 'UNIQUE(system, code)', 'Ce code existe déjà dans la nomenclature !'),
+    ]
+
+    def init(self):
+        # Autocomplétion : préfixe de code (index btree) et recherche approchée par trigrammes
+        create_index(self.env.cr, 'clinic_clinical_code_code_prefix_idx', self._table,
+                     ['system', 'code varchar_pattern_ops'])
+        if ensure_pg_trgm(self.env.cr):
+            create_index(self.env.cr, 'clinic_clinical_code_trgm_idx', self._table,
+                         ['code gin_trgm_ops', 'name gin_trgm_ops'], method='gin')
+
+    @api.depends('code', 'name')
+    def _compute_display_name(self):
+        for record in self:
+            record.display_name = '%s - %s' % (record.code, record.name) if record.code else record.name
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._link_observations(codes=records.mapped('code'))
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        old_codes = self.mapped('code') if {'system', 'code'}.intersection(vals) else []
+        result = super().write(vals)
+        if old_codes:
+            self._link_observations(codes=old_codes + self.mapped('code'))
+        if {'system', 'code', 'name', 'active'}.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    # ------------------------------------------------------------------ #
+    # Autocomplétion                                                     #
+    # ------------------------------------------------------------------ #
+    @tools.ormcache('system')
+    def _get_code_index(self, system):
+        """
+        Index en mémoire, par worker, des codes actifs d'une nomenclature : les codes triés (en
+        majuscules) et, au même rang, (id, code, libellé). Les codes d'un même préfixe étant
+        contigus, une recherche par préfixe se ramène à deux dichotomies.
+        """
+        self.env.cr.execute("""
+            SELECT UPPER(code), id, code, name FROM clinic_clinical_code WHERE system = %s AND active
+        """, [system])
+        # tri Python (et non la collation de la base), le même ordre que bisect
+        rows = sorted(self.env.cr.fetchall())
+        return tuple(row[0] for row in rows), tuple(row[1:] for row in rows)
+
+    @api.model
+    def autocomplete(self, system, term, limit=20):
+        """
+        Codes dont le code commence par `term`, sans requête une fois l'index chargé ; complété si
+        besoin par une recherche sur le libellé (index trigrammes).
+        """
+        self.check_access_rights('read')
+        prefix = (term or '').strip().upper()
+        if not prefix:
+            return []
+        keys, entries = self._get_code_index(system)
+        start = bisect_left(keys, prefix)
+        end = min(bisect_left(keys, prefix + '\uffff'), start + limit)
+        results = [{'id': id_, 'code': code, 'name': name} for id_, code, name in entries[start:end]]
+        if len(results) < limit:
+            results += self.search_read(
+                [('system', '=', system), ('name', 'ilike', term.strip()),
+                 ('id', 'not in', [result['id'] for result in results])],
+                ['code', 'name'], limit=limit - len(results), order='code')
+        return results
+
+    # ------------------------------------------------------------------ #
+    # Import des tables de codes                                         #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _import_file(self, system, path, delimiter=',', chunk_size=5000, auto_commit=False):
+        """
+        Charge une table de codes depuis un fichier CSV local, lue ligne à ligne et insérée par
+        paquets de `chunk_size` : la mémoire utilisée ne dépend pas de la taille du fichier.
+        Retourne le nombre de lignes lues.
+        """
+        code_column, name_column = CODE_FILE_COLUMNS[system]
+        total = 0
+        with open(path, newline='', encoding='utf-8-sig') as stream:
+            reader = csv.DictReader(stream, delimiter=delimiter)
+            if not {code_column, name_column}.issubset(reader.fieldnames or []):
+                raise UserError(_("Le fichier doit contenir les colonnes %s et %s.", code_column, name_column))
+            chunk = {}
+            for row in reader:
+                code = (row[code_column] or '').strip()
+                if code:
+                    chunk[code] = (row[name_column] or '').strip() or code
+                if len(chunk) >= chunk_size:
+                    total += self._upsert_codes(system, chunk)
+                    chunk = {}
+                    if auto_commit:
+                        self.env.cr.commit()
+            total += self._upsert_codes(system, chunk)
+        self._link_observations()
+        self.env.registry.clear_cache()
+        if auto_commit:
+            self.env.cr.commit()
+        _logger.info("Imported %s %s codes from %s", total, system, path)
+        return total
+
+    @api.model
+    def _upsert_codes(self, system, codes):
+        if not codes:
+            return 0
+        self.env.cr.execute(UPSERT_CODES_SQL, {
+            'system': system,
+            'codes': list(codes),
+            'names': list(codes.values()),
+            'uid': self.env.uid,
+        })
+        return len(codes)
+
+    @api.model
+    def _link_observations(self, codes=None):
+        """
+        Rattache au catalogue les observations saisies avant la création de leur code, et détache
+        celles dont l'entrée a changé de code ; limité aux observations des `codes` donnés.
+        """
+        self.env['clinic.observation'].flush_model(['code', 'code_id'])
+        self.flush_model(['system', 'code'])
+        codes_clause = "AND o.code = ANY(%(codes)s)" if codes is not None else ""
+        self.env.cr.execute("""
+            UPDATE clinic_observation o SET code_id = c.id
+              FROM clinic_clinical_code c
+             WHERE c.system = 'loinc' AND c.code = o.code AND o.code_id IS DISTINCT FROM c.id
+                   {codes_clause}
+        """.format(codes_clause=codes_clause), {'codes': list(codes or [])})
+        self.env.cr.execute("""
+            UPDATE clinic_observation o SET code_id = NULL
+              FROM clinic_clinical_code c
+             WHERE c.id = o.code_id AND (c.system != 'loinc' OR c.code != o.code)
+                   {codes_clause}
+        """.format(codes_clause=codes_clause), {'codes': list(codes or [])})
+        self.env['clinic.observation'].invalidate_model(['code_id'])
+        self.invalidate_model()
+
+
+class ClinicalCodeImport(models.TransientModel):
+    _name = 'clinic.clinical.code.import'
+    _description = 'Import de codes cliniques'
+
+    system = fields.Selection(CODE_SYSTEMS, string='Nomenclature', required=True, default='loinc')
+    file_path = fields.Char(string='Fichier', required=True,
+                            help="Chemin du fichier CSV sur le serveur (ex. Loinc.csv de la distribution LOINC)")
+    delimiter = fields.Char(string='Séparateur', default=',', required=True, size=1)
+
+    def action_import(self):
+        self.ensure_one()
+        try:
+            count = self.env['clinic.clinical.code']._import_file(self.system, self.file_path, self.delimiter)
+        except OSError as e:
+            raise UserError(_("Impossible de lire le fichier %s : %s", self.file_path, e))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'message': _("%s codes importés.", count),
+                'type': 'success',
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
@@ -5,11 +5,58 @@ from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError
 from datetime import datetime, timedelta
 
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+from .hc_base import add_exclusion_constraint, catch_exclusion_violation, flush_exclusion_violation, \
+    missing_constraints
+
+# Créneau d'une consultation (1h par défaut sans date de fin), utilisé par les contraintes d'exclusion
+ENCOUNTER_PERIOD_SQL = "tsrange(start, GREATEST(start, COALESCE(\"end\", start + interval '1 hour')), '[)')"
+ENCOUNTER_OVERLAP_CONSTRAINTS = {
+    'room_id': 'clinic_encounter_room_id_no_overlap',
+    'doctor_id': 'clinic_encounter_doctor_id_no_overlap',
+}
+
+# Modèles et champs modifiables depuis la console du médecin (apply_clinical_operations)
+CLINICAL_OPERATION_MODELS = {
+    'observation': ('clinic.observation', ['code', 'value_float', 'value_unit', 'value_str', 'datetime',
+                                           'is_abnormal']),
+    'prescription': ('clinic.prescription', ['name', 'datetime']),
+}
+
+# Champs d'une observation dont dépend son marquage anormal (voir clinic.reference.range)
+FLAGGED_FIELDS = {'encounter_id', 'code', 'value_float', 'value_unit', 'value_str', 'datetime'}
+
+# Séries d'un patient regroupées par intervalles : min / max / dernière valeur de chaque intervalle
+FLOWSHEET_BUCKETS_SQL = """
+    SELECT code,
+           LEAST(FLOOR(EXTRACT(EPOCH FROM datetime - %s) / %s), %s) AS bucket,
+           MAX(datetime),
+           MIN(value_float),
+           MAX(value_float),
+           (ARRAY_AGG(value_float ORDER BY datetime DESC))[1],
+           (ARRAY_AGG(value_unit ORDER BY datetime DESC))[1],
+           COUNT(*)
+      FROM clinic_observation
+     WHERE id IN %s
+  GROUP BY code, bucket
+  ORDER BY code, bucket
+"""
+
+FLOWSHEET_POINTS_SQL = """
+    SELECT code, datetime, value_float, value_float, value_float, value_unit, 1
+      FROM clinic_observation
+     WHERE id IN %s
+  ORDER BY code, datetime
+"""
+
 
 class Encounter(models.Model):
     _name = "clinic.encounter"
     _description = "Consultation"
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'clinic.dashboard.mixin']
+    _dashboard_sections = ('encounters',)
     _order = "start desc, name"
     _rec_name = 'display_name'
 
@@ -132,6 +179,13 @@ class Encounter(models.Model):
         help="Diagnostic principal et différentiels"
     )
 
+    diagnosis_code_id = fields.Many2one(
+        "clinic.clinical.code",
+        string="Code CIM-10",
+        domain="[('system', '=', 'icd10')]",
+        index=True
+    )
+
     treatment_plan = fields.Text(
         string="Plan de traitement",
         help="Plan thérapeutique recommandé"
@@ -182,56 +236,78 @@ class Encounter(models.Model):
     )
 
     # === CONSTRAINTES ===
-    @api.constrains('room_id', 'start', 'end')
-    def _check_room_availability(self):
-        """Vérifier la disponibilité de la salle"""
-        for encounter in self:
-            if encounter.room_id and encounter.start and encounter.state != 'cancelled':
-                end_time = encounter.end or encounter.start + timedelta(hours=1)
-
-                # Rechercher les consultations en conflit
-                conflicting_encounters = self.search([
-                    ('room_id', '=', encounter.room_id.id),
-                    ('start', '<', end_time),
-                    ('end', '>', encounter.start) if encounter.end else ('start', '>',
-                                                                         encounter.start - timedelta(hours=1)),
-                    ('id', '!=', encounter.id),
-                    ('state', 'in', ['draft', 'in_progress']),
-                ])
-
-                if conflicting_encounters:
-                    raise ValidationError(
-                        _("La salle %s est déjà réservée pour une autre consultation à ce moment. "
-                          "Conflit avec: %s") % (
-                            encounter.room_id.name,
-                            ', '.join(conflicting_encounters.mapped('name'))
-                        )
-                    )
-
-    @api.constrains('doctor_id', 'start', 'end')
-    def _check_doctor_availability(self):
-        """Vérifier la disponibilité du médecin"""
-        for encounter in self:
-            if encounter.doctor_id and encounter.start and encounter.state != 'cancelled':
-                end_time = encounter.end or encounter.start + timedelta(hours=1)
-
-                conflicting_encounters = self.search([
-                    ('doctor_id', '=', encounter.doctor_id.id),
-                    ('start', '<', end_time),
-                    ('end', '>', encounter.start) if encounter.end else ('start', '>',
-                                                                         encounter.start - timedelta(hours=1)),
-                    ('id', '!=', encounter.id),
-                    ('state', 'in', ['draft', 'in_progress']),
-                ])
-
-                if conflicting_encounters:
-                    raise ValidationError(
-                        _("Le médecin %s n'est pas disponible à ce moment. "
-                          "Conflit avec: %s") % (
-                            encounter.doctor_id.name,
-                            ', '.join(conflicting_encounters.mapped('name'))
-                        )
-                    )
+    def init(self):
+        # Contraintes d'exclusion : pas de chevauchement salle / médecin entre consultations actives
+        for column, constraint in ENCOUNTER_OVERLAP_CONSTRAINTS.items():
+            add_exclusion_constraint(
+                self.env.cr, self._table, constraint,
+                "(%s WITH =, %s WITH &&) WHERE (state IN ('draft', 'in_progress'))"
+                % (column, ENCOUNTER_PERIOD_SQL))
+
+    @api.constrains('room_id', 'doctor_id', 'start', 'end', 'state')
+    def _check_availability(self):
+        """
+        Vérifier la disponibilité de la salle et du médecin : contraintes d'exclusion en base, et
+        recherche des chevauchements en Python pour celles qui n'ont pas pu être créées.
+        """
+        violated = flush_exclusion_violation(self, ['room_id', 'doctor_id', 'start', 'end', 'state'])
+        missing = missing_constraints(self.env.cr, self._table, ENCOUNTER_OVERLAP_CONSTRAINTS.values())
+        for column, constraint in ENCOUNTER_OVERLAP_CONSTRAINTS.items():
+            if constraint != violated and constraint not in missing:
+                continue
+            encounter, conflicts = self._find_overlapping(column)
+            if constraint != violated and not conflicts:
+                continue
+            self._raise_unavailable(column, encounter[column], conflicts)
+
+    def _find_overlapping(self, column):
+        """Retrouve la première consultation du lot en conflit sur `column` (message d'erreur, ou repli sans contrainte)"""
+        for encounter in self.filtered(lambda e: e.state in ('draft', 'in_progress')):
+            conflicts = self._search_overlapping(column, encounter[column].id, encounter.start,
+                                                 encounter.end or encounter.start + timedelta(hours=1),
+                                                 exclude_id=encounter.id)
+            if conflicts:
+                return encounter, conflicts
+        return self[:1], self.browse()
+
+    @api.model
+    def _search_overlapping(self, column, resource_id, start, end, exclude_id=False):
+        """Consultations actives occupant la salle ou le médecin `resource_id` sur [start, end)."""
+        return self.search([
+            (column, '=', resource_id),
+            ('start', '<', end),
+            ('id', '!=', exclude_id),
+            ('state', 'in', ['draft', 'in_progress']),
+        ]).filtered(lambda e: (e.end or e.start + timedelta(hours=1)) > start)
+
+    @api.model
+    def _raise_unavailable(self, column, resource, conflicts):
+        if column == 'room_id':
+            raise ValidationError(
+                _("La salle %s est déjà réservée pour une autre consultation à ce moment. "
+                  "Conflit avec: %s") % (resource.name, ', '.join(conflicts.mapped('name')))
+            )
+        raise ValidationError(
+            _("Le médecin %s n'est pas disponible à ce moment. "
+              "Conflit avec: %s") % (resource.name, ', '.join(conflicts.mapped('name')))
+        )
+
+    @api.model
+    def _raise_create_conflict(self, constraint, vals_list):
+        """Message du chevauchement refusé par `constraint` à la création, les consultations n'existant pas."""
+        column = next(col for col, name in ENCOUNTER_OVERLAP_CONSTRAINTS.items() if name == constraint)
+        resource = self.env[self._fields[column].comodel_name]
+        for vals in vals_list:
+            if vals.get('state', 'draft') not in ('draft', 'in_progress') or not vals.get(column):
+                continue
+            resource = resource.browse(vals[column])
+            start = fields.Datetime.to_datetime(vals.get('start')) or fields.Datetime.now()
+            end = fields.Datetime.to_datetime(vals.get('end')) or start + timedelta(hours=1)
+            conflicts = self._search_overlapping(column, vals[column], start, end)
+            if conflicts:
+                self._raise_unavailable(column, resource, conflicts)
+        # conflit entre consultations créées ensemble
+        self._raise_unavailable(column, resource, self.browse())
 
     @api.constrains('start', 'end')
     def _check_dates_consistency(self):
@@ -295,19 +371,23 @@ class Encounter(models.Model):
             )
 
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Générer la séquence et logique de création"""
-        if not vals.get('name'):
-            vals["name"] = self.env["ir.sequence"].next_by_code("clinic.encounter") or _('Nouveau')
+        to_number = [vals for vals in vals_list if not vals.get('name')]
+        names = self.env["ir.sequence"].next_by_code_batch("clinic.encounter", len(to_number))
+        for vals, name in zip(to_number, names):
+            vals["name"] = name or _('Nouveau')
 
-        encounter = super().create(vals)
+        # un chevauchement est refusé dès l'insertion par les contraintes d'exclusion
+        encounters, violated = catch_exclusion_violation(self.env.cr, super().create, vals_list)
+        if violated:
+            self._raise_create_conflict(violated, vals_list)
 
         # Notifier le médecin assigné
-        if encounter.doctor_id:
-            encounter._notify_doctor_assignment()
+        encounters.filtered('doctor_id')._notify_doctor_assignment()
 
-        return encounter
+        return encounters
 
     def write(self, vals):
         """Logique de modification"""
@@ -321,12 +401,62 @@ class Encounter(models.Model):
 
         result = super().write(vals)
 
+        # le sexe et l'âge du patient déterminent l'intervalle de référence des observations
+        if 'patient_id' in vals:
+            self.env['clinic.reference.range']._flag_observations(self.observations_ids.ids)
+
         # Synchroniser avec l'appointment si état change
         if 'state' in vals:
             self._sync_with_appointment()
 
         return result
 
+    # ------------------------------------------------------------------ #
+    # Console du médecin                                                 #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def get_doctor_bootstrap(self, encounter_id=None):
+        """
+        Tout ce qu'il faut pour ouvrir la console du médecin en une requête : le médecin de
+        l'utilisateur, sa consultation en cours (à défaut la prochaine du jour), la fiche du
+        patient, les observations, prescriptions et antécédents.
+        """
+        doctor = self.env['res.partner'].sudo().search([('user_ids', 'in', self.env.user.ids), ('doctor', '=', True)],
+                                                limit=1)
+        result = {'doctor': {'id': doctor.id, 'name': doctor.name} if doctor else None, 'encounter': None}
+        if encounter_id:
+            encounter = self.browse(int(encounter_id)).exists()
+        elif doctor:
+            encounter = self.search([('doctor_id', '=', doctor.id), ('state', '=', 'in_progress')],
+                                    order='start desc', limit=1)
+            if not encounter:
+                today = fields.Datetime.to_datetime(fields.Date.context_today(self))
+                encounter = self.search([('doctor_id', '=', doctor.id), ('state', '=', 'draft'),
+                                         ('start', '>=', today)], order='start asc', limit=1)
+        else:
+            encounter = self.browse()
+        if not encounter:
+            return result
+
+        patient = encounter.patient_id
+        result.update({
+            'encounter': encounter.read(['name', 'state', 'start', 'chief_complaint', 'diagnosis',
+                                         'treatment_plan', 'follow_up'])[0],
+            'patient': {
+                'id': patient.id,
+                'name': patient.name,
+                'age': patient.age or '',
+                'gender': patient.gender or '',
+                'phone': patient.phone or '',
+                'num_carte_chifa': patient.num_carte_chifa or '',
+            },
+            'observations': encounter.observations_ids.read(
+                ['code', 'value_float', 'value_unit', 'value_str', 'datetime', 'is_abnormal']),
+            'prescriptions': encounter.prescriptions_ids.read(['name', 'datetime']),
+            'medical_history': patient.medical_history_ids.read(['history_type', 'description', 'date']),
+        })
+        return result
+
     # ------------------------------------------------------------------ #
     # 1)  Notifications et synchronisation                               #
     # ------------------------------------------------------------------ #
@@ -452,11 +582,58 @@ class Encounter(models.Model):
             'encounter_id': self.id,
             'physician_id': self.env.user.id,
         })
-        for vals in lines_vals_list:
-            vals['prescription_id'] = prescription.id
-            self.env['clinic.medication.line'].create(vals)
+        self.env['clinic.medication.line'].create([
+            dict(vals, prescription_id=prescription.id) for vals in lines_vals_list
+        ])
         return prescription
 
+    def apply_clinical_operations(self, operations):
+        """
+        Applique en une transaction un lot de modifications d'observations et d'ordonnances de
+        la consultation. Chaque opération est un dictionnaire :
+            {'model': 'observation' | 'prescription', 'op': 'create' | 'write' | 'unlink',
+             'ref': <clé client, création>, 'id': <id, modification / suppression>, 'vals': {...}}
+        Les créations, modifications et suppressions sont regroupées par modèle. Retourne les
+        enregistrements créés, indexés par leur clé client.
+        """
+        self.ensure_one()
+        created = {}
+        for key, (model_name, allowed_fields) in CLINICAL_OPERATION_MODELS.items():
+            ops = [op for op in operations if op.get('model') == key]
+            if not ops:
+                continue
+            Model = self.env[model_name]
+            forbidden = {name for op in ops for name in op.get('vals') or {}} - set(allowed_fields)
+            if forbidden:
+                raise UserError(_("Champs non modifiables : %s", ', '.join(sorted(forbidden))))
+
+            try:
+                ids = {int(op['id']) for op in ops if op['op'] in ('write', 'unlink')}
+            except (KeyError, TypeError, ValueError):
+                raise UserError(_("Les modifications portent sur des éléments non enregistrés."))
+            if ids and len(Model.search([('id', 'in', list(ids)), ('encounter_id', '=', self.id)])) != len(ids):
+                raise UserError(_("Certains éléments n'appartiennent pas à la consultation %s.", self.name))
+
+            # les modifications successives d'un même enregistrement sont fusionnées, puis
+            # les enregistrements recevant les mêmes valeurs sont écrits ensemble
+            to_unlink = {int(op['id']) for op in ops if op['op'] == 'unlink'}
+            vals_by_id = {}
+            for op in ops:
+                if op['op'] == 'write' and int(op['id']) not in to_unlink:
+                    vals_by_id.setdefault(int(op['id']), {}).update(op.get('vals') or {})
+            ids_by_vals = {}
+            for record_id, vals in vals_by_id.items():
+                ids_by_vals.setdefault(tuple(sorted(vals.items())), []).append(record_id)
+            for vals, record_ids in ids_by_vals.items():
+                Model.browse(record_ids).write(dict(vals))
+            Model.browse(to_unlink).unlink()
+
+            creates = [op for op in ops if op['op'] == 'create']
+            records = Model.create([dict(op.get('vals') or {}, encounter_id=self.id) for op in creates])
+            rows = {row['id']: row for row in records.read(allowed_fields)}
+            created[key] = {op['ref']: rows[record.id] for op, record in zip(creates, records)}
+        return {'created': created}
+
 
 class Observation(models.Model):
     _name = "clinic.observation"
@@ -470,3 +647,86 @@ class Observation(models.Model):
     datetime = fields.Datetime(string="Date et heure", default=fields.Datetime.now)
     performer_id = fields.Many2one("res.users", string="Exécutant")
     is_abnormal = fields.Boolean(string="Est anormal")
+    # marquage posé par un intervalle de référence (clinic.reference.range) ; une saisie manuelle l'annule
+    abnormal_auto = fields.Boolean(string="Marquage automatique", readonly=True, copy=False)
+    patient_id = fields.Many2one("res.partner", string="Patient", related="encounter_id.patient_id", store=True)
+    # choisi dans le catalogue, il renseigne `code` ; saisi librement, `code` y est rattaché s'il existe
+    code_id = fields.Many2one("clinic.clinical.code", string="Code catalogue", compute="_compute_code_id",
+                              store=True, readonly=False, index=True, domain="[('system', '=', 'loinc')]")
+
+    @api.depends('code')
+    def _compute_code_id(self):
+        codes = self.env['clinic.clinical.code'].search(
+            [('system', '=', 'loinc'), ('code', 'in', list(set(self.mapped('code'))))])
+        code_ids = {code.code: code.id for code in codes}
+        for observation in self:
+            observation.code_id = code_ids.get(observation.code, False)
+
+    @api.onchange('code_id')
+    def _onchange_code_id(self):
+        for observation in self.filtered('code_id'):
+            observation.code = observation.code_id.code
+
+    def _code_from_catalog(self, vals):
+        """Valeurs où le code saisi est, à défaut, celui de l'entrée choisie dans le catalogue."""
+        if vals.get('code_id') and not vals.get('code'):
+            vals = dict(vals, code=self.env['clinic.clinical.code'].browse(vals['code_id']).code)
+        return vals
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        observations = super().create([self._code_from_catalog(vals) for vals in vals_list])
+        self.env['clinic.reference.range']._flag_observations(observations.ids)
+        return observations
+
+    def write(self, vals):
+        vals = self._code_from_catalog(vals)
+        if 'is_abnormal' in vals and 'abnormal_auto' not in vals:
+            vals = dict(vals, abnormal_auto=False)
+        result = super().write(vals)
+        if FLAGGED_FIELDS.intersection(vals):
+            self.env['clinic.reference.range']._flag_observations(self.ids)
+        return result
+
+    def init(self):
+        # Séries temporelles d'un patient : toutes consultations confondues, par code puis par date
+        create_index(self.env.cr, 'clinic_observation_patient_code_datetime_idx', self._table,
+                     ['patient_id', 'code', 'datetime'])
+
+    @api.model
+    def get_flowsheet(self, patient_id, codes=None, date_from=None, date_to=None, buckets=None):
+        """
+        Séries temporelles des observations d'un patient, par code, sur toutes ses consultations.
+        Sans `buckets`, chaque mesure est retournée ; sinon la période est découpée en `buckets`
+        intervalles égaux et seuls le min, le max et la dernière valeur de chacun sont retournés.
+        Retourne {code: {'unit': ..., 'points': [[date, min, max, dernière, nombre], ...]}}.
+        """
+        self.env['res.partner'].browse(int(patient_id)).check_access_rule('read')
+        self.check_access_rights('read')
+        self.flush_model(['patient_id', 'code', 'datetime', 'value_float', 'value_unit'])
+        # observations filtrées par _search : les règles d'accès s'appliquent aussi aux requêtes SQL
+        domain = [('patient_id', '=', int(patient_id))]
+        if codes:
+            domain.append(('code', 'in', list(codes)))
+        date_to = fields.Datetime.to_datetime(date_to) or fields.Datetime.now()
+        date_from = fields.Datetime.to_datetime(date_from)
+        if not date_from:
+            self.env.cr.execute(SQL("SELECT MIN(datetime) FROM clinic_observation WHERE id IN %s",
+                                    self._search(domain).subselect()))
+            date_from = self.env.cr.fetchone()[0] or date_to
+        query = self._search(domain + [('datetime', '>=', date_from), ('datetime', '<=', date_to)])
+        if buckets:
+            # une mesure à date_to tombe dans le dernier intervalle, pas dans un intervalle de plus
+            step = max((date_to - date_from).total_seconds() / int(buckets), 1)
+            self.env.cr.execute(SQL(FLOWSHEET_BUCKETS_SQL, date_from, step, int(buckets) - 1, query.subselect()))
+            rows = [row[:1] + row[2:] for row in self.env.cr.fetchall()]
+        else:
+            self.env.cr.execute(SQL(FLOWSHEET_POINTS_SQL, query.subselect()))
+            rows = self.env.cr.fetchall()
+
+        series = {}
+        for code, date, low, high, last, unit, count in rows:
+            serie = series.setdefault(code, {'unit': unit, 'points': []})
+            serie['unit'] = unit or serie['unit']
+            serie['points'].append([fields.Datetime.to_string(date), low, high, last, count])
+        return series
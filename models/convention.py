@@ -1,4 +1,8 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
+from odoo.tools import frozendict
+
+# Paramètre incrémenté à chaque modification d'une grille ou d'un acte (_bump_price_matrix_version)
+PRICE_MATRIX_VERSION_KEY = 'clinic.price_matrix_version'
 
 
 class Convention(models.Model):
@@ -35,3 +39,126 @@ class Convention(models.Model):
 
     pricelist_id = fields.Many2one("product.pricelist", string="Grille tarifaire", required=True)
 
+    partner_id = fields.Many2one('res.partner', string='Organisme payeur',
+                                 help="Partenaire facturé pour les encaissements des patients conventionnés")
+
+    coverage_rate = fields.Float(string='Taux de prise en charge (%)', default=100.0,
+                                 help="Part du tarif conventionné réclamée à l'organisme payeur")
+
+    # ------------------------------------------------------------------ #
+    # Matrice des prix conventionnés                                     #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _get_act_prices(self, pricelist, acts):
+        """
+        Prix unitaires de `acts` dans la grille tarifaire `pricelist` : {product_id: prix}.
+        Les actes médicaux sont lus dans la matrice (grille × acte) en cache, les autres
+        produits sont évalués à la demande.
+        """
+        date = fields.Date.context_today(self)
+        matrix = self._get_price_matrix(pricelist.id, date, self.env.company.id, self._get_price_matrix_version())
+        prices = {act.id: matrix[act.id] for act in acts if act.id in matrix}
+        missing = acts.filtered(lambda act: act.id not in prices)
+        if missing:
+            prices.update(pricelist._get_products_price(missing, 1.0, date=date))
+        return prices
+
+    @api.model
+    def _get_price_matrix_version(self):
+        """Version courante des matrices, lue en base à chaque appel (une ligne par sa clé)."""
+        self.env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", [PRICE_MATRIX_VERSION_KEY])
+        row = self.env.cr.fetchone()
+        return row[0] if row else '0'
+
+    @api.model
+    def _bump_price_matrix_version(self):
+        """
+        Périme les matrices en cache de tous les workers, sans vider le reste du cache ORM : la
+        version fait partie de la clé. Écrite en SQL, le paramètre ne passe pas par set_param.
+        """
+        self.env.cr.execute("""
+            INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+            VALUES (%(key)s, '1', %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT (key) DO UPDATE
+               SET value = (COALESCE(NULLIF(ir_config_parameter.value, ''), '0')::bigint + 1)::varchar,
+                   write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+        """, {'key': PRICE_MATRIX_VERSION_KEY, 'uid': self.env.uid})
+
+    @tools.ormcache('pricelist_id', 'date', 'company_id', 'version')
+    def _get_price_matrix(self, pricelist_id, date, company_id, version):
+        """
+        Évalue une seule fois les règles de la grille pour tous les actes médicaux, dans la société
+        `company_id` (coûts et devises en dépendent), pour la `version` courante des grilles et actes.
+        """
+        env = self.env(su=True, context=dict(self.env.context, allowed_company_ids=[company_id]))
+        acts = env['product.product'].with_context(active_test=False).search([('is_medical_act', '=', True)])
+        pricelist = env['product.pricelist'].browse(pricelist_id)
+        return frozendict(pricelist._get_products_price(acts, 1.0, date=date))
+
+
+class PricelistItem(models.Model):
+    _inherit = 'product.pricelist.item'
+
+    # toute modification d'une règle périme les matrices (les grilles peuvent dépendre les unes des autres)
+    @api.model_create_multi
+    def create(self, vals_list):
+        items = super().create(vals_list)
+        self.env['clinic.convention']._bump_price_matrix_version()
+        return items
+
+    def write(self, vals):
+        result = super().write(vals)
+        self.env['clinic.convention']._bump_price_matrix_version()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['clinic.convention']._bump_price_matrix_version()
+        return result
+
+
+class Pricelist(models.Model):
+    _inherit = 'product.pricelist'
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'currency_id' in vals or 'company_id' in vals:
+            self.env['clinic.convention']._bump_price_matrix_version()
+        return result
+
+
+# Champs produit lus par les règles des grilles (prix public, coût, catégorie)
+PRICE_MATRIX_PRODUCT_FIELDS = {'list_price', 'lst_price', 'standard_price', 'categ_id', 'price_extra'}
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        result = super().write(vals)
+        # seuls les actes médicaux figurent dans les matrices (pas les articles valorisés en stock)
+        if PRICE_MATRIX_PRODUCT_FIELDS.intersection(vals) and \
+                self.with_context(active_test=False).product_variant_ids.filtered('is_medical_act'):
+            self.env['clinic.convention']._bump_price_matrix_version()
+        return result
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    def write(self, vals):
+        result = super().write(vals)
+        if PRICE_MATRIX_PRODUCT_FIELDS.intersection(vals) and self.filtered('is_medical_act'):
+            self.env['clinic.convention']._bump_price_matrix_version()
+        return result
+
+
+class ProductCategory(models.Model):
+    _inherit = 'product.category'
+
+    def write(self, vals):
+        # les règles par catégorie s'appliquent aussi aux sous-catégories
+        result = super().write(vals)
+        if 'parent_id' in vals:
+            self.env['clinic.convention']._bump_price_matrix_version()
+        return result
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api
+from odoo.tools import date_utils
+
+_logger = logging.getLogger(__name__)
+
+DASHBOARD_SECTIONS = ['partners', 'admissions', 'appointments', 'encounters', 'cash', 'operations', 'beds']
+
+# Cache de réponse par processus : {(dbname, company_id, groups_key): (expire_at, etag, data)}
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+
+def _clear_response_cache(dbname):
+    with _response_cache_lock:
+        for key in [key for key in _response_cache if key[0] == dbname]:
+            del _response_cache[key]
+
+
+class DashboardSnapshot(models.Model):
+    _name = 'clinic.dashboard.snapshot'
+    _description = 'Instantané du tableau de bord'
+    _rec_name = 'section'
+
+    section = fields.Char(string='Section', required=True, index=True)
+    # les indicateurs sont calculés avec les droits du lecteur : un instantané par société et groupes
+    company_id = fields.Many2one('res.company', string='Société', required=True, ondelete='cascade')
+    groups_key = fields.Char(string='Groupes', required=True)
+    payload = fields.Json(string='Données')
+    date = fields.Date(string='Date de calcul', help="Les indicateurs sur 7 jours dépendent de la date du jour")
+    dirty = fields.Boolean(string='À recalculer', default=True, index=True)
+
+    _sql_constraints = [
+        ('section_unique', 'UNIQUE(section, company_id, groups_key)',
+         'Une seule ligne par section du tableau de bord, société et groupes !'),
+    ]
+
+    def init(self):
+        # instantanés antérieurs à la clé (société, groupes) : simple cache, recalculé à la lecture
+        self.env.cr.execute("DELETE FROM clinic_dashboard_snapshot WHERE company_id IS NULL OR groups_key IS NULL")
+
+    # ------------------------------------------------------------------ #
+    # Lecture                                                            #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _get_snapshot_key(self):
+        """(société, groupes) de l'utilisateur : les règles d'accès du module ne dépendent que d'eux."""
+        return self.env.company.id, ','.join(str(group_id) for group_id in sorted(self.env.user.groups_id.ids))
+
+    @api.model
+    def get_dashboard_data(self):
+        """
+        Retourne les données du tableau de bord en ne recalculant que les sections invalidées.
+        Les sections sont calculées avec les droits de l'utilisateur (règles d'accès, société
+        courante) et partagées avec les utilisateurs de même société et mêmes groupes.
+        """
+        today = fields.Date.context_today(self)
+        company_id, groups_key = self._get_snapshot_key()
+        domain = [('company_id', '=', company_id), ('groups_key', '=', groups_key)]
+        snapshots = self.sudo().search(domain)
+        stale = [s.section for s in snapshots if s.dirty or s.date != today]
+        missing = set(DASHBOARD_SECTIONS) - set(snapshots.mapped('section'))
+        if stale or missing:
+            self.with_context(allowed_company_ids=[company_id])._refresh_sections(stale + list(missing))
+            snapshots = self.sudo().search(domain)
+
+        data = {}
+        for snapshot in snapshots:
+            data.update(snapshot.payload or {})
+        return data
+
+    @api.model
+    def get_cached_dashboard_data(self):
+        """
+        Retourne (etag, données) depuis le cache de réponse, recalculé à l'expiration du TTL.
+        La clé du cache est celle de l'instantané : deux utilisateurs partagent une entrée
+        exactement quand ils partagent les mêmes données.
+        """
+        key = (self.env.cr.dbname,) + self._get_snapshot_key()
+        now = time.monotonic()
+        cached = _response_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        data = self.get_dashboard_data()
+        etag = hashlib.sha1(json.dumps(data, sort_keys=True, default=date_utils.json_default)
+                            .encode()).hexdigest()
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('clinic.dashboard_cache_ttl', 10))
+        with _response_cache_lock:
+            _response_cache[key] = (now + ttl, etag, data)
+        return etag, data
+
+    # ------------------------------------------------------------------ #
+    # Invalidation et recalcul                                           #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _invalidate_sections(self, sections):
+        """Marque des sections à recalculer, une seule fois par transaction (au commit)."""
+        if not sections:
+            return
+        dirty = self.env.cr.precommit.data.setdefault('clinic.dashboard.dirty', set())
+        if not dirty:
+            self.env.cr.precommit.add(self._flush_invalidation)
+        dirty.update(sections)
+
+    @api.model
+    def _flush_invalidation(self):
+        sections = self.env.cr.precommit.data.pop('clinic.dashboard.dirty', set())
+        if sections:
+            # "AND NOT dirty" : aucun verrou de ligne si la section est déjà invalidée
+            self.env.cr.execute("""
+                UPDATE clinic_dashboard_snapshot SET dirty = true
+                WHERE section = ANY(%s) AND NOT dirty
+            """, [list(sections)])
+            # les autres workers s'appuient sur le TTL
+            dbname = self.env.cr.dbname
+            self.env.cr.postcommit.add(lambda: _clear_response_cache(dbname))
+
+    @api.model
+    def _refresh_sections(self, sections):
+        """Recalcule les sections, avec les droits de l'environnement courant, dans l'instantané de sa clé."""
+        today = fields.Date.context_today(self)
+        company_id, groups_key = self._get_snapshot_key()
+        for section in sections:
+            try:
+                with self.env.cr.savepoint():
+                    payload = getattr(self, '_compute_section_%s' % section)(today)
+            except Exception as e:
+                _logger.warning("Error computing dashboard section %s: %s", section, str(e))
+                continue
+            # deux lecteurs simultanés peuvent recalculer la même section : le dernier l'emporte
+            self.env.cr.execute("""
+                INSERT INTO clinic_dashboard_snapshot
+                       (section, company_id, groups_key, payload, date, dirty,
+                        create_uid, create_date, write_uid, write_date)
+                VALUES (%(section)s, %(company_id)s, %(groups_key)s, %(payload)s, %(date)s, false,
+                        %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC')
+                ON CONFLICT (section, company_id, groups_key) DO UPDATE
+                   SET payload = EXCLUDED.payload, date = EXCLUDED.date, dirty = false,
+                       write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            """, {
+                'section': section,
+                'company_id': company_id,
+                'groups_key': groups_key,
+                # Le champ Json ne sait pas sérialiser les dates
+                'payload': json.dumps(payload, default=date_utils.json_default),
+                'date': today,
+                'uid': self.env.uid,
+            })
+        self.invalidate_model()
+
+    @api.model
+    def _cron_rebuild(self):
+        """
+        Filet de sécurité pour les modifications non suivies : invalide tous les instantanés, recalculés
+        à la prochaine lecture avec les droits du lecteur.
+        """
+        self.env.cr.execute("UPDATE clinic_dashboard_snapshot SET dirty = true WHERE NOT dirty")
+        self.invalidate_model(['dirty'])
+
+    # ------------------------------------------------------------------ #
+    # Calcul des sections                                                #
+    # ------------------------------------------------------------------ #
+    def _compute_section_partners(self, today):
+        Partner = self.env['res.partner']
+        return {
+            'total_patients': Partner.search_count([('patient', '=', True)]),
+            'total_doctors': Partner.search_count([('doctor', '=', True)]),
+        }
+
+    def _compute_section_admissions(self, today):
+        Admission = self.env['clinic.admission']
+        return {
+            'total_admissions': Admission.search_count([('state', '=', 'admitted')]),
+            'admissions_live': Admission.search_read(
+                [('state', 'in', ['admitted', 'pre_admit'])],
+                ['id', 'name', 'patient_id', 'service_id', 'bed_id', 'state']
+            ),
+        }
+
+    def _compute_section_appointments(self, today):
+        week_ago = today - relativedelta(days=7)
+        appointments = self.env['clinic.appointment'].read_group(
+            [('date_rdv', '>=', week_ago), ('date_rdv', '<=', today)],
+            ['date_rdv'],
+            ['date_rdv:day'],
+            orderby='date_rdv:day'
+        )
+        return {
+            'appointments_data': [{'date': group['date_rdv:day'], 'count': group['date_rdv_count']}
+                                  for group in appointments],
+        }
+
+    def _compute_section_encounters(self, today):
+        week_ago = today - relativedelta(days=7)
+        consultations = self.env['clinic.encounter'].read_group(
+            [('start', '>=', week_ago), ('start', '<=', today)],
+            ['type'],
+            ['type']
+        )
+        return {
+            'consultations_data': [{'type': group['type'], 'count': group['type_count']}
+                                   for group in consultations],
+        }
+
+    def _compute_section_cash(self, today):
+        week_ago = today - relativedelta(days=7)
+        kpis = self.env['clinic.cash_entry'].get_financial_kpis(date_from=week_ago, today=today)
+        revenue_by_service = self.env['clinic.report.revenue.service'].read_group(
+            [('day', '>=', week_ago)],
+            ['service_id', 'total:sum'],
+            ['service_id']
+        )
+        cash_statements = self.env['clinic.cash_statement'].search(
+            [('date', '>=', week_ago)],
+            order='date asc'
+        )
+        return {
+            'avg_payment_delay': kpis['avg_payment_delay'],
+            'residual_total': kpis['amount_residual'],
+            'cash_entry_data': [{'state': group['state'], 'count': group['count']}
+                                for group in kpis['by_payment_state']],
+            'revenue_by_doctor': kpis['revenue_by_doctor'],
+            'cash_statement_data': [{'date': str(st.date), 'balance': st.total_cash_entry}
+                                    for st in cash_statements],
+            'revenue_by_service': [{'service': group['service_id'][1], 'total': group['total']}
+                                   for group in revenue_by_service if group['service_id']],
+        }
+
+    def _compute_section_operations(self, today):
+        week_ago = today - relativedelta(days=7)
+        Operation = self.env['clinic.operation']
+        week_domain = [('start_datetime', '>=', fields.Datetime.to_string(week_ago)),
+                       ('start_datetime', '<=', fields.Datetime.to_string(today))]
+
+        operation_data = Operation.read_group(week_domain, ['state'], ['state'])
+
+        or_occupation = self.env['clinic.kpi.or.occupation'].search_read(
+            [('day', '>=', week_ago), ('day', '<=', today)],
+            ['day', 'occupation_rate_percent']
+        )
+        for item in or_occupation:
+            item['day'] = str(item['day'])
+
+        now = fields.Datetime.now()
+        or_today = Operation.search_read(
+            [('start_datetime', '>=', now.replace(hour=0, minute=0, second=0)),
+             ('start_datetime', '<=', now.replace(hour=23, minute=59, second=59)),
+             ('state', '!=', 'cancel')],
+            ['id', 'name', 'room_id', 'start_datetime', 'duration_minutes',
+             'patient_id', 'surgeon_id', 'state']
+        )
+        return {
+            'operation_count': sum(r['state_count'] for r in operation_data),
+            'operation_data': [{'state': r['state'], 'count': r['state_count']} for r in operation_data],
+            'or_occupation': or_occupation,
+            'or_today': or_today,
+        }
+
+    def _compute_section_beds(self, today):
+        bed_occupancy = {}
+        beds = self.env['clinic.bed'].read_group(
+            [], ['service_id', 'state'], ['service_id', 'state'], lazy=False
+        )
+        # {service_id: {free: n, occupied: n, maintenance: n}}
+        for b in beds:
+            svc = b['service_id'][0] if b['service_id'] else 0
+            bed_occupancy.setdefault(svc, {})[b['state']] = b['__count']
+        return {'bed_occupancy': bed_occupancy}
+
+
+class DashboardMixin(models.AbstractModel):
+    """Invalide les sections du tableau de bord impactées par les modifications du modèle."""
+    _name = 'clinic.dashboard.mixin'
+    _description = 'Suivi des modifications pour le tableau de bord'
+
+    # sections du tableau de bord alimentées par le modèle
+    _dashboard_sections = ()
+    # champs qui impactent ces sections (None : tous)
+    _dashboard_fields = None
+
+    def _invalidate_dashboard(self, vals=None):
+        if vals is not None and self._dashboard_fields is not None \
+                and not self._dashboard_fields.intersection(vals):
+            return
+        self.env['clinic.dashboard.snapshot'].sudo()._invalidate_sections(self._dashboard_sections)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._invalidate_dashboard()
+        return records
+
+    def write(self, vals):
+        result = super().write(vals)
+        self._invalidate_dashboard(vals)
+        return result
+
+    def unlink(self):
+        self._invalidate_dashboard()
+        return super().unlink()
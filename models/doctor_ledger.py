@@ -0,0 +1,202 @@
+from odoo import models, fields, api
+
+# Sources des quotes-parts : colonne du relevé alimentée, mouvement courant d'un enregistrement
+# du lot `changed` (doctor_id, period, amount) et condition pour qu'il soit reporté.
+LEDGER_SOURCES = {
+    'clinic.cash_entry.line': {
+        'table': 'clinic_cash_entry_line',
+        'column': 'amount_due',
+        'other_column': 'amount_paid',
+        'partner_column': 'total_cote_part',
+        'rest_sign': '+',
+        'current': """
+            SELECT c.id, c.doctor_id_dec AS doctor_id, date_trunc('month', c.date_dec)::date AS period,
+                   COALESCE(c.cote_part, 0) AS amount
+              FROM changed c
+             WHERE c.doctor_id_dec IS NOT NULL AND c.date_dec IS NOT NULL
+        """,
+    },
+    'clinic.cash_exit': {
+        'table': 'clinic_cash_exit',
+        'column': 'amount_paid',
+        'other_column': 'amount_due',
+        'partner_column': 'total_cote_recue',
+        'rest_sign': '-',
+        'current': """
+            SELECT c.id, c.partner_id AS doctor_id, date_trunc('month', c.date)::date AS period,
+                   COALESCE(c.montant, 0) AS amount
+              FROM changed c
+             WHERE c.motif = 'Quote-part' AND c.partner_id IS NOT NULL AND c.date IS NOT NULL
+        """,
+    },
+}
+
+
+class DoctorLedger(models.Model):
+    _name = 'clinic.doctor.ledger'
+    _description = 'Relevé mensuel des quotes-parts'
+    _order = 'period desc, doctor_id'
+    _rec_name = 'doctor_id'
+
+    doctor_id = fields.Many2one('res.partner', string='Médecin', domain="[('doctor', '=', True)]",
+                                required=True, readonly=True, index=True, ondelete='cascade')
+    period = fields.Date(string='Période', required=True, readonly=True, index=True,
+                         help="Premier jour du mois")
+    currency_id = fields.Many2one('res.currency', string='Devise', default=lambda self: self.env.company.currency_id)
+    opening_balance = fields.Monetary(string='Solde reporté', readonly=True)
+    amount_due = fields.Monetary(string='Quote-part due', readonly=True)
+    amount_paid = fields.Monetary(string='Quote-part versée', readonly=True)
+    closing_balance = fields.Monetary(string='Solde', compute='_compute_closing_balance')
+    state = fields.Selection([
+        ('open', 'Ouvert'),
+        ('closed', 'Clôturé'),
+    ], string='État', default='open', required=True, readonly=True, index=True)
+    date_done = fields.Datetime(string='Date de clôture', readonly=True)
+
+    _sql_constraints = [
+        ('doctor_period_unique', 'UNIQUE(doctor_id, period)', 'Un seul relevé par médecin et par mois !'),
+    ]
+
+    @api.depends('opening_balance', 'amount_due', 'amount_paid')
+    def _compute_closing_balance(self):
+        for ledger in self:
+            ledger.closing_balance = ledger.opening_balance + ledger.amount_due - ledger.amount_paid
+
+    # ------------------------------------------------------------------ #
+    # Clôture des périodes                                               #
+    # ------------------------------------------------------------------ #
+    def action_close_period(self):
+        """Clôture les relevés, ainsi que les mois ouverts antérieurs du même médecin, et reporte le solde."""
+        for ledger in self.sorted('period'):
+            if ledger.state == 'closed':
+                continue
+            earlier = self.search([('doctor_id', '=', ledger.doctor_id.id), ('period', '<', ledger.period),
+                                   ('state', '=', 'open')], order='period')
+            for statement in earlier | ledger:
+                statement._close_and_carry_forward()
+
+    def _close_and_carry_forward(self):
+        self.ensure_one()
+        self.write({'state': 'closed', 'date_done': fields.Datetime.now()})
+        next_period = fields.Date.add(self.period, months=1)
+        following = self.search([('doctor_id', '=', self.doctor_id.id), ('period', '=', next_period)])
+        if following:
+            following.opening_balance = self.closing_balance
+        else:
+            self.create({
+                'doctor_id': self.doctor_id.id,
+                'period': next_period,
+                'opening_balance': self.closing_balance,
+            })
+
+    @api.model
+    def _cron_close_periods(self):
+        """Relevés mensuels : clôture tous les mois ouverts antérieurs au mois en cours."""
+        current_period = fields.Date.context_today(self).replace(day=1)
+        self.search([('state', '=', 'open'), ('period', '<', current_period)]).action_close_period()
+
+    # ------------------------------------------------------------------ #
+    # Report des mouvements                                              #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _mark_pending(self, records):
+        """Programme le report de lignes d'encaissement / décaissements, une seule fois par transaction."""
+        if not records:
+            return
+        data = self.env.cr.precommit.data
+        if not any(data.get('clinic.doctor_ledger.%s' % source) for source in LEDGER_SOURCES):
+            self.env.cr.precommit.add(self._flush_pending)
+        data.setdefault('clinic.doctor_ledger.%s' % records._name, set()).update(records.ids)
+
+    @api.model
+    def _flush_pending(self):
+        self.env.flush_all()
+        for source in LEDGER_SOURCES:
+            ids = self.env.cr.precommit.data.pop('clinic.doctor_ledger.%s' % source, set())
+            if ids:
+                self._post_moves(source, list(ids))
+
+    @api.model
+    def _post_moves(self, source, ids, reverse_only=False):
+        """
+        Reporte par delta les quotes-parts des enregistrements `ids` de `source` dans les relevés
+        mensuels et dans les totaux du médecin : le montant déjà reporté est contrepassé et le
+        montant courant reporté. Un mouvement tombant dans un mois clôturé est reporté sur le
+        mois en cours. Avec `reverse_only`, seule la contrepassation est faite (suppression).
+        """
+        spec = LEDGER_SOURCES[source]
+        current = "SELECT * FROM (%s) cur WHERE NOT %%(reverse_only)s" % spec['current']
+        self.env.cr.execute("""
+            WITH changed AS (
+                SELECT * FROM {table} WHERE id = ANY(%(ids)s) FOR UPDATE
+            ), cur_moves AS ({current}
+            ), raw_moves AS (
+                SELECT doctor_id, period, amount FROM cur_moves
+                UNION ALL
+                SELECT cote_posted_doctor_id, cote_posted_period, -COALESCE(cote_posted, 0)
+                  FROM changed
+                 WHERE cote_posted_doctor_id IS NOT NULL
+            ), moves AS (
+                SELECT m.doctor_id,
+                       CASE WHEN cl.state = 'closed' THEN %(current_period)s ELSE m.period END AS period,
+                       SUM(m.amount) AS amount
+                  FROM raw_moves m
+             LEFT JOIN clinic_doctor_ledger cl ON cl.doctor_id = m.doctor_id AND cl.period = m.period
+              GROUP BY 1, 2
+                HAVING SUM(m.amount) != 0
+            ), ledger AS (
+                INSERT INTO clinic_doctor_ledger (doctor_id, period, currency_id, opening_balance,
+                                                  {column}, {other_column}, state,
+                                                  create_uid, create_date, write_uid, write_date)
+                SELECT doctor_id, period, %(currency_id)s, 0, amount, 0, 'open',
+                       %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                  FROM moves
+                ON CONFLICT (doctor_id, period) DO UPDATE
+                   SET {column} = clinic_doctor_ledger.{column} + EXCLUDED.{column},
+                       write_uid = EXCLUDED.write_uid,
+                       write_date = EXCLUDED.write_date
+            ), totals AS (
+                UPDATE res_partner p
+                   SET {partner_column} = COALESCE(p.{partner_column}, 0) + d.amount,
+                       total_cote_rest = COALESCE(p.total_cote_rest, 0) {rest_sign} d.amount
+                  FROM (SELECT doctor_id, SUM(amount) AS amount FROM moves GROUP BY doctor_id) d
+                 WHERE p.id = d.doctor_id
+            )
+            UPDATE {table} t
+               SET cote_posted = COALESCE(cur.amount, 0),
+                   cote_posted_doctor_id = cur.doctor_id,
+                   cote_posted_period = cur.period
+              FROM changed c
+         LEFT JOIN cur_moves cur ON cur.id = c.id
+             WHERE t.id = c.id
+        """.format(current=current, **spec), {
+            'ids': ids,
+            'reverse_only': reverse_only,
+            'current_period': fields.Date.context_today(self).replace(day=1),
+            'currency_id': self.env.company.currency_id.id,
+            'uid': self.env.uid,
+        })
+        self.env[source].invalidate_model(['cote_posted', 'cote_posted_doctor_id', 'cote_posted_period'])
+        self.env['res.partner'].invalidate_model(['total_cote_part', 'total_cote_recue', 'total_cote_rest'])
+        self.invalidate_model(['amount_due', 'amount_paid'])
+
+    @api.model
+    def _rebuild(self):
+        """
+        Recalcule entièrement les montants reportés depuis les lignes d'encaissement et les
+        décaissements, à l'installation : les mois déjà clôturés seraient reportés sur le mois en cours.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE res_partner SET total_cote_part = 0, total_cote_recue = 0, total_cote_rest = 0
+             WHERE total_cote_part != 0 OR total_cote_recue != 0 OR total_cote_rest != 0;
+            UPDATE clinic_doctor_ledger SET amount_due = 0, amount_paid = 0;
+        """)
+        for source, spec in LEDGER_SOURCES.items():
+            self.env.cr.execute("""
+                UPDATE {table} SET cote_posted = 0, cote_posted_doctor_id = NULL, cote_posted_period = NULL
+            """.format(**spec))
+            self.env.cr.execute("SELECT id FROM {table}".format(**spec))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if ids:
+                self._post_moves(source, ids)
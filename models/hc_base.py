@@ -1,5 +1,69 @@
+import logging
+
+from psycopg2 import errors
+
 from odoo import fields, models,api
 from odoo.exceptions import UserError
+from odoo.tools.sql import constraint_definition
+
+_logger = logging.getLogger(__name__)
+
+
+def ensure_btree_gist(cr):
+    """Active btree_gist (index GiST mixant entiers et plages) ; retourne False si impossible."""
+    try:
+        with cr.savepoint():
+            cr.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+        return True
+    except Exception as e:
+        _logger.warning("Could not enable btree_gist extension: %s", str(e))
+        return False
+
+
+def ensure_pg_trgm(cr):
+    """Active pg_trgm (index trigrammes pour les recherches ilike) ; retourne False si impossible."""
+    try:
+        with cr.savepoint():
+            cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        return True
+    except Exception as e:
+        _logger.warning("Could not enable pg_trgm extension: %s", str(e))
+        return False
+
+
+def add_exclusion_constraint(cr, tablename, constraintname, definition):
+    """Ajoute une contrainte d'exclusion si elle n'existe pas (ignorée si des données la violent déjà)."""
+    if constraint_definition(cr, tablename, constraintname) or not ensure_btree_gist(cr):
+        return
+    try:
+        with cr.savepoint():
+            cr.execute('ALTER TABLE "%s" ADD CONSTRAINT "%s" EXCLUDE USING gist %s'
+                       % (tablename, constraintname, definition))
+    except Exception as e:
+        _logger.warning("Could not add exclusion constraint %s on %s, overlaps will be checked in Python: %s",
+                        constraintname, tablename, str(e))
+
+
+def missing_constraints(cr, tablename, constraintnames):
+    """
+    Contraintes absentes de la table parmi `constraintnames` : add_exclusion_constraint a pu les
+    ignorer (btree_gist indisponible, données déjà en conflit). Les appelants vérifient alors en Python.
+    """
+    return {name for name in constraintnames if not constraint_definition(cr, tablename, name)}
+
+
+def catch_exclusion_violation(cr, func, *args):
+    """Appelle `func` dans un savepoint ; retourne (résultat, None), ou (None, contrainte d'exclusion violée)."""
+    try:
+        with cr.savepoint():
+            return func(*args), None
+    except errors.ExclusionViolation as e:
+        return None, e.diag.constraint_name
+
+
+def flush_exclusion_violation(records, fnames):
+    """Écrit les champs en base ; retourne le nom de la contrainte d'exclusion violée, sinon None."""
+    return catch_exclusion_violation(records.env.cr, records.flush_model, fnames)[1]
 
 
 class Service(models.Model):
@@ -31,6 +95,8 @@ class Service(models.Model):
 class Bed(models.Model):
     _name = "clinic.bed"
     _description = "Lit / place"
+    _inherit = ['clinic.dashboard.mixin']
+    _dashboard_sections = ('beds',)
 
     name = fields.Char("Label", required=True)
     # ward_id = fields.Many2one("clinic.ward", ondelete="cascade")
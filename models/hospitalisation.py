@@ -32,9 +32,10 @@ class Hospitalisation(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            if vals.get('name', 'Nouveau') == 'Nouveau':
-                vals['name'] = self.env['ir.sequence'].next_by_code('clinic.hospitalisation') or 'Nouveau'
+        to_number = [vals for vals in vals_list if vals.get('name', 'Nouveau') == 'Nouveau']
+        names = self.env['ir.sequence'].next_by_code_batch('clinic.hospitalisation', len(to_number))
+        for vals, name in zip(to_number, names):
+            vals['name'] = name or 'Nouveau'
         return super().create(vals_list)
 
     @api.depends('entry_date', 'exit_date')
@@ -89,9 +90,10 @@ class NursingPlan(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            if vals.get('name', 'Nouveau') == 'Nouveau':
-                vals['name'] = self.env['ir.sequence'].next_by_code('clinic.nursing.plan') or 'Nouveau'
+        to_number = [vals for vals in vals_list if vals.get('name', 'Nouveau') == 'Nouveau']
+        names = self.env['ir.sequence'].next_by_code_batch('clinic.nursing.plan', len(to_number))
+        for vals, name in zip(to_number, names):
+            vals['name'] = name or 'Nouveau'
         return super().create(vals_list)
 
 
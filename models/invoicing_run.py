@@ -0,0 +1,146 @@
+import logging
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class InvoicingRun(models.Model):
+    _name = 'clinic.invoicing.run'
+    _description = 'Facturation groupée des encaissements'
+    _inherit = ['mail.thread']
+    _order = 'id desc'
+
+    name = fields.Char(string='Référence', readonly=True, copy=False, default=lambda self: _('Nouveau'))
+    scope = fields.Selection([
+        ('statement', 'Relevé de caisse'),
+        ('period', 'Période'),
+        ('convention', 'Convention'),
+    ], string='Périmètre', default='period', required=True)
+    statement_id = fields.Many2one('clinic.cash_statement', string='Relevé de Caisse')
+    date_from = fields.Date(string='Du')
+    date_to = fields.Date(string='Au')
+    convention_id = fields.Many2one('clinic.convention', string='Convention')
+    group_by = fields.Selection([
+        ('patient', 'Par patient'),
+        ('payer', 'Par payeur'),
+    ], string='Regroupement', default='patient', required=True,
+        help="Par payeur : les encaissements des patients conventionnés sont facturés à l'organisme payeur "
+             "de la convention")
+    journal_id = fields.Many2one('account.journal', string='Journal', domain="[('type', '=', 'sale')]",
+                                 default=lambda self: self.env['account.journal'].search(
+                                     [('type', '=', 'sale'), ('company_id', '=', self.env.company.id)], limit=1))
+    company_id = fields.Many2one('res.company', string='Société', default=lambda self: self.env.company,
+                                 required=True)
+    state = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('running', 'En cours'),
+        ('failed', 'Interrompue'),
+        ('done', 'Terminée'),
+    ], string='État', default='draft', readonly=True, copy=False, tracking=True)
+    entry_count = fields.Integer(string='Encaissements à facturer', readonly=True, copy=False)
+    invoiced_count = fields.Integer(string='Encaissements facturés', readonly=True, copy=False)
+    move_count = fields.Integer(string='Factures créées', readonly=True, copy=False)
+    progress = fields.Float(string='Progression', compute='_compute_progress')
+    last_error = fields.Text(string='Dernière erreur', readonly=True, copy=False)
+
+    @api.depends('entry_count', 'invoiced_count')
+    def _compute_progress(self):
+        for run in self:
+            run.progress = 100.0 * run.invoiced_count / run.entry_count if run.entry_count else 0.0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [vals for vals in vals_list if vals.get('name', _('Nouveau')) == _('Nouveau')]
+        numbers = self.env['ir.sequence'].next_by_code_batch('clinic.invoicing.run', len(to_number))
+        for vals, number in zip(to_number, numbers):
+            vals['name'] = number or _('Nouveau')
+        return super(InvoicingRun, self).create(vals_list)
+
+    # ------------------------------------------------------------------ #
+    # Actions                                                            #
+    # ------------------------------------------------------------------ #
+    def action_start(self):
+        """Lance (ou reprend) la facturation ; les lots sont traités en arrière-plan par le cron."""
+        for run in self:
+            if not run.journal_id:
+                raise UserError(_("Aucun journal de vente n'est configuré pour la facturation."))
+            if run.state == 'draft':
+                run.entry_count = self.env['clinic.cash_entry'].search_count(run._get_entry_domain())
+            run.write({'state': 'running', 'last_error': False})
+        self.env.ref('clinic.cron_process_invoicing_runs')._trigger()
+
+    def action_open_invoices(self):
+        self.ensure_one()
+        moves = self.env['clinic.cash_entry'].search([('invoicing_run_id', '=', self.id)]).invoice_id
+        return {
+            'name': _('Factures'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'account.move',
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', moves.ids)],
+        }
+
+    # ------------------------------------------------------------------ #
+    # Traitement par lots                                                #
+    # ------------------------------------------------------------------ #
+    def _get_entry_domain(self):
+        self.ensure_one()
+        domain = self.env['clinic.cash_entry']._get_unbilled_domain() + [('acts_ids', '!=', False)]
+        if self.scope == 'statement':
+            domain.append(('statement_id', '=', self.statement_id.id))
+        elif self.scope == 'convention':
+            domain.append(('convention_id', '=', self.convention_id.id))
+        if self.date_from:
+            domain.append(('date', '>=', self.date_from))
+        if self.date_to:
+            domain.append(('date', '<=', self.date_to))
+        return domain
+
+    @api.model
+    def _cron_process_runs(self):
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('clinic.invoicing_batch_size', 500))
+        for run in self.search([('state', '=', 'running')]):
+            run._process(batch_size, auto_commit=True)
+
+    def _process(self, batch_size, auto_commit=False):
+        """
+        Facture les encaissements du périmètre par lots de `batch_size`. Chaque lot est validé
+        séparément : une exécution interrompue reprend là où elle s'était arrêtée, les
+        encaissements déjà facturés sortant du périmètre. Les lignes réclamées sur un bordereau
+        ne sont facturées que pour leur part non réclamée.
+        """
+        self.ensure_one()
+        CashEntry = self.env['clinic.cash_entry']
+        domain = self._get_entry_domain()
+        while True:
+            if self.group_by == 'payer':
+                # une facture par payeur et par mois, et par lot : dans l'ordre des dates, un mois
+                # n'est réparti que sur les lots qu'il remplit, sans jamais dépasser batch_size
+                entries = CashEntry.search(domain, order='date, id', limit=batch_size)
+            else:
+                entries = CashEntry.search(domain, order='id', limit=batch_size)
+            if not entries:
+                self.state = 'done'
+                break
+            if self.group_by == 'patient':
+                # un patient est facturé en une fois, même à cheval sur deux lots
+                entries |= CashEntry.search(domain + entries._invoice_group_domain(self.group_by))
+            try:
+                with self.env.cr.savepoint():
+                    moves = entries._create_grouped_invoices(self.journal_id, self.group_by)
+                    entries.invoicing_run_id = self
+                    self.write({
+                        'invoiced_count': self.invoiced_count + len(entries),
+                        'move_count': self.move_count + len(moves),
+                    })
+            except Exception as e:
+                _logger.exception("Invoicing run %s failed", self.name)
+                self.write({'state': 'failed', 'last_error': str(e)})
+                break
+            if auto_commit:
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        if auto_commit:
+            self.env.cr.commit()
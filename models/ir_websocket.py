@@ -0,0 +1,27 @@
+from odoo import models
+
+from .appointment import BOARD_CHANNEL_PREFIX, _board_channel
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        """
+        Les canaux du tableau de la salle d'attente, demandés par leur nom, sont remplacés par les
+        canaux d'enregistrement des services, pour les seuls utilisateurs autorisés à lire les
+        rendez-vous : le nom seul ne donne pas accès aux diffusions (noms des patients).
+        """
+        requested = {channel for channel in channels
+                     if isinstance(channel, str) and channel.startswith(BOARD_CHANNEL_PREFIX)}
+        if requested:
+            channels = [channel for channel in channels if channel not in requested]
+            if self.env['clinic.appointment'].check_access_rights('read', raise_exception=False):
+                service_ids = {int(channel[len(BOARD_CHANNEL_PREFIX):]) for channel in requested
+                               if channel[len(BOARD_CHANNEL_PREFIX):].isdigit()}
+                services = self.env['clinic.service'].browse(service_ids - {0}).exists()
+                services = services._filter_access_rules('read')
+                channels += [_board_channel(self.env, service_id) for service_id in services.ids]
+                if 0 in service_ids:
+                    channels.append(_board_channel(self.env, False))
+        return super()._build_bus_channel_list(channels)
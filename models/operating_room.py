@@ -3,6 +3,14 @@ from odoo import models, fields, api, _
 from datetime import timedelta
 from odoo.exceptions import UserError
 
+from .hc_base import add_exclusion_constraint, catch_exclusion_violation, flush_exclusion_violation, \
+    missing_constraints
+
+OPERATION_OVERLAP_CONSTRAINTS = {
+    'room_id': 'clinic_operation_room_id_no_overlap',
+    'surgeon_id': 'clinic_operation_surgeon_id_no_overlap',
+}
+
 
 class OperatingRoom(models.Model):
     _name = 'clinic.operating.room'
@@ -20,7 +28,8 @@ class OperatingRoom(models.Model):
 class Operation(models.Model):
     _name = 'clinic.operation'
     _description = 'Intervention programmée'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'clinic.dashboard.mixin']
+    _dashboard_sections = ('operations',)
     _order = 'start_datetime desc'
 
     name = fields.Char(readonly=True, copy=False)
@@ -50,24 +59,52 @@ class Operation(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            if vals.get('name', 'Nouveau') == 'Nouveau':
-                vals['name'] = self.env['ir.sequence'].next_by_code('clinic.operation') or 'Nouveau'
-        return super().create(vals_list)
+        to_number = [vals for vals in vals_list if vals.get('name', 'Nouveau') == 'Nouveau']
+        names = self.env['ir.sequence'].next_by_code_batch('clinic.operation', len(to_number))
+        for vals, name in zip(to_number, names):
+            vals['name'] = name or 'Nouveau'
+        # un chevauchement est refusé dès l'insertion par les contraintes d'exclusion
+        operations, violated = catch_exclusion_violation(self.env.cr, super().create, vals_list)
+        if violated:
+            self._raise_unavailable(next(col for col, name in OPERATION_OVERLAP_CONSTRAINTS.items()
+                                         if name == violated))
+        return operations
 
-    @api.constrains('room_id', 'start_datetime', 'duration_minutes')
+    def init(self):
+        # Contraintes d'exclusion : ni la salle ni le chirurgien sur deux interventions programmées simultanées
+        for column, constraint in OPERATION_OVERLAP_CONSTRAINTS.items():
+            add_exclusion_constraint(
+                self.env.cr, self._table, constraint,
+                "(%s WITH =, tsrange(start_datetime, GREATEST(start_datetime, stop_datetime), '[)') WITH &&) "
+                "WHERE (state IN ('scheduled', 'in_progress'))" % column)
+
+    @api.constrains('room_id', 'surgeon_id', 'start_datetime', 'duration_minutes', 'state')
     def _check_room_overlap(self):
-        for op in self:
-            if op.state != 'cancel':
-                others = self.search([
-                    ('id', '!=', op.id),
-                    ('room_id', '=', op.room_id.id),
-                    ('state', 'in', ['scheduled', 'in_progress']),
-                    ('start_datetime', '<', op.stop_datetime),
-                    ('stop_datetime', '>', op.start_datetime),
-                ])
-                if others:
-                    raise UserError(_("La salle est déjà occupée à ce créneau."))
+        violated = flush_exclusion_violation(self, ['room_id', 'surgeon_id', 'start_datetime',
+                                                    'stop_datetime', 'state'])
+        missing = missing_constraints(self.env.cr, self._table, OPERATION_OVERLAP_CONSTRAINTS.values())
+        for column, constraint in OPERATION_OVERLAP_CONSTRAINTS.items():
+            if constraint == violated or (constraint in missing and self._has_overlap(column)):
+                self._raise_unavailable(column)
+
+    @api.model
+    def _raise_unavailable(self, column):
+        if column == 'room_id':
+            raise UserError(_("La salle est déjà occupée à ce créneau."))
+        raise UserError(_("Le chirurgien est déjà occupé à ce créneau."))
+
+    def _has_overlap(self, column):
+        """Recherche des chevauchements sur `column`, lorsque la contrainte d'exclusion n'a pas pu être créée."""
+        for op in self.filtered(lambda o: o.state in ('scheduled', 'in_progress') and o[column]):
+            if self.search_count([
+                ('id', '!=', op.id),
+                (column, '=', op[column].id),
+                ('state', 'in', ['scheduled', 'in_progress']),
+                ('start_datetime', '<', op.stop_datetime),
+                ('stop_datetime', '>', op.start_datetime),
+            ], limit=1):
+                return True
+        return False
 
     # ---------------- BUTTONS ----------------
     def action_confirm(self):
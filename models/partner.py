@@ -1,12 +1,43 @@
+import re
+
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+from odoo.tools import escape_psql
+from odoo.tools.sql import create_index
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
+from .hc_base import ensure_pg_trgm
+
+# Colonnes de la recherche patient à l'accueil, chacune avec son index trigrammes (partiel, patients seuls)
+PATIENT_SEARCH_COLUMNS = {
+    'name': 'name',
+    'num_carte_chifa': 'num_carte_chifa',
+    'patient_sequance': 'patient_sequance',
+    'phone': "regexp_replace(phone, '[^0-9]', '', 'g')",
+}
+
+# Patients actifs correspondant au terme, les plus pertinents d'abord : identifiant ou N° CHIFA exact,
+# puis début de nom / d'identifiant, puis les noms les plus courts
+PATIENT_LOOKUP_SQL = """
+    SELECT id
+      FROM res_partner
+     WHERE patient AND active AND ({conditions})
+  ORDER BY CASE WHEN patient_sequance = %(term)s OR num_carte_chifa = %(term)s THEN 0
+                WHEN name ILIKE %(prefix)s OR patient_sequance ILIKE %(prefix)s
+                     OR num_carte_chifa ILIKE %(prefix)s THEN 1
+                ELSE 2
+           END,
+           LENGTH(name), id
+     LIMIT %(limit)s
+"""
+
 
 class Partner(models.Model):
-    _inherit = 'res.partner'
+    _inherit = ['res.partner', 'clinic.dashboard.mixin']
     _description = 'Personne'
+    _dashboard_sections = ('partners',)
+    _dashboard_fields = {'patient', 'doctor', 'active'}
 
     @api.depends('date_of_birth')
     def onchange_age(self):
@@ -48,77 +79,120 @@ class Partner(models.Model):
 
     currency_id = fields.Many2one('res.currency', default=lambda self: self.env.company.currency_id)
 
-    total_rest = fields.Monetary(string='Reste à payer', compute='_compute_total_rest', store=True,
+    # maintenu par delta depuis les encaissements (clinic.cash_entry._post_patient_balance)
+    total_rest = fields.Monetary(string='Reste à payer', readonly=True, index=True, copy=False,
                                  help="Montant total restant à payer pour le patient")
 
     speciality = fields.Char(string='Spécialité', store=True)
     percentage_cote_part = fields.Float(string='% Cote part', default=0.0,
                                         help="Pourcentage de cote part pour les médecins")
-    total_cote_part = fields.Monetary(string='Total cote part', compute='_compute_cote', store=True,
+    # maintenus par delta depuis les quotes-parts et décaissements (clinic.doctor.ledger._post_moves)
+    total_cote_part = fields.Monetary(string='Total cote part', readonly=True, copy=False,
                                       help="Total des cotes parts dues au médecin")
-    total_cote_recue = fields.Monetary(string='Cote part reçue', compute='_compute_cote', store=True,
+    total_cote_recue = fields.Monetary(string='Cote part reçue', readonly=True, copy=False,
                                        help="Total des cotes parts reçues")
-    total_cote_rest = fields.Monetary(string='Cote part restante', compute='_compute_cote', store=True,
+    total_cote_rest = fields.Monetary(string='Cote part restante', readonly=True, copy=False,
                                       help="Cote part restante à payer au médecin")
+    doctor_ledger_ids = fields.One2many('clinic.doctor.ledger', 'doctor_id', string='Relevés de quote-part')
 
     transactions_cash = fields.One2many('clinic.cash_entry.line', 'doctor_id_dec', string='Transactions cote part')
     received_cash = fields.One2many('clinic.cash_exit', 'partner_id', string='Décaissements reçus')
     transactions_cash_patient = fields.One2many('clinic.cash_entry', 'patient_id', string='Encaissements patient')
     medical_history_ids = fields.One2many('clinic.medical_history', 'patient_id', string='Antécédent Médical')
 
-    @api.model
-    def create(self, vals):
-        print(vals.get('patient'))
-        if vals.get('patient'):
-            ps = self.env['ir.sequence'].next_by_code('clinic.patient')
-            print(ps)
-            if ps:
-                vals.update({
-                    'patient_sequance': ps,
-                })
-        elif vals.get('doctor'):
-            ds = self.env['ir.sequence'].next_by_code('clinic.doctor')
-            if ds:
-                vals.update({
-                    'patient_sequance': ds,
-                })
-        result = super(Partner, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        patients = [vals for vals in vals_list if vals.get('patient')]
+        doctors = [vals for vals in vals_list if not vals.get('patient') and vals.get('doctor')]
+        for code, group in (('clinic.patient', patients), ('clinic.doctor', doctors)):
+            sequences = self.env['ir.sequence'].next_by_code_batch(code, len(group))
+            for vals, seq in zip(group, sequences):
+                if seq:
+                    vals['patient_sequance'] = seq
+        result = super(Partner, self).create(vals_list)
+        return result
+
+    def write(self, vals):
+        result = super(Partner, self).write(vals)
+        if 'percentage_cote_part' in vals:
+            # la quote-part des lignes en dépend et est recalculée sans passer par leur write
+            self.env['clinic.doctor.ledger']._mark_pending(self.transactions_cash)
+        if {'gender', 'date_of_birth'}.intersection(vals):
+            observations = self.env['clinic.observation'].sudo().search([('patient_id', 'in', self.ids)])
+            self.env['clinic.reference.range'].sudo()._flag_observations(observations.ids)
         return result
 
+    def init(self):
+        if not ensure_pg_trgm(self.env.cr):
+            return
+        for column, expression in PATIENT_SEARCH_COLUMNS.items():
+            create_index(self.env.cr, 'res_partner_patient_%s_trgm_idx' % column, self._table,
+                         ['(%s) gin_trgm_ops' % expression], method='gin', where='patient')
+
+    # ------------------------------------------------------------------ #
+    # Recherche patient                                                  #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _search_patient_ids(self, term, limit=20):
+        """
+        Ids des patients dont le nom contient tous les mots de `term`, ou dont l'identifiant, le
+        N° CHIFA ou le téléphone (chiffres seuls) le contient, par pertinence décroissante.
+        Chaque condition est servie par un index trigrammes ; les règles d'accès sont appliquées.
+        """
+        term = (term or '').strip()
+        if not term:
+            return []
+        params = {'term': term, 'prefix': escape_psql(term) + '%', 'like': '%' + escape_psql(term) + '%',
+                  'limit': limit}
+        conditions = ['num_carte_chifa ILIKE %(like)s', 'patient_sequance ILIKE %(like)s']
+        words = term.split()
+        name_conditions = []
+        for index, word in enumerate(words):
+            params['word_%s' % index] = '%' + escape_psql(word) + '%'
+            name_conditions.append('name ILIKE %%(word_%s)s' % index)
+        conditions.append('(%s)' % ' AND '.join(name_conditions))
+        digits = re.sub(r'[^0-9]', '', term)
+        if len(digits) >= 3:
+            params['digits'] = '%' + digits + '%'
+            conditions.append("%s LIKE %%(digits)s" % PATIENT_SEARCH_COLUMNS['phone'])
+
+        self.flush_model(['name', 'num_carte_chifa', 'patient_sequance', 'phone', 'patient', 'active'])
+        self.env.cr.execute(PATIENT_LOOKUP_SQL.format(conditions=' OR '.join(conditions)), params)
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        allowed = set(self._search([('id', 'in', ids)]))
+        return [id_ for id_ in ids if id_ in allowed]
+
+    @api.model
+    def lookup_patients(self, term, limit=20):
+        """Recherche patient de l'accueil : fiches correspondantes, les plus pertinentes d'abord."""
+        patients = self.browse(self._search_patient_ids(term, limit=limit))
+        return [{
+            'id': patient.id,
+            'name': patient.name,
+            'patient_sequance': patient.patient_sequance or '',
+            'num_carte_chifa': patient.num_carte_chifa or '',
+            'phone': patient.phone or '',
+            'age': patient.age or '',
+        } for patient in patients]
+
+    @api.model
+    def _name_search(self, name, domain=None, operator='ilike', limit=None, order=None):
+        # champs Many2one limités aux patients : recherche indexée et classée par pertinence
+        # les domaines reçus du client sont des listes JSON : feuilles comparées en tuples
+        patients_only = any(isinstance(leaf, (list, tuple)) and tuple(leaf) == ('patient', '=', True)
+                            for leaf in domain or [])
+        if name and operator == 'ilike' and patients_only:
+            ids = self._search_patient_ids(name, limit=limit or 100)
+            allowed = set(self._search(list(domain) + [('id', 'in', ids)]))
+            return [id_ for id_ in ids if id_ in allowed]
+        return super()._name_search(name, domain=domain, operator=operator, limit=limit, order=order)
+
     @api.constrains('patient', 'doctor')
     def _check_role_exclusivity(self):
         for record in self:
             if record.patient and record.doctor:
                 raise ValidationError(_("Une personne ne peut pas être à la fois patient et médecin."))
 
-    @api.depends('transactions_cash_patient', 'transactions_cash_patient.amount_total')
-    def _compute_total_rest(self):
-        for record in self:
-            if record.patient:
-                entries = self.env['clinic.cash_entry'].search([('patient_id', '=', record.id)])
-                total_residual = sum(entry.amount_residual for entry in entries)
-                payed_lefts = sum(entry.amount_payed for entry in entries if entry.rest and not entry.supplement)
-                payed_supplements = sum(
-                    entry.amount_payed - (entry.montant + entry.tax_amount)
-                    for entry in entries if entry.rest and entry.supplement
-                )
-                record.total_rest = total_residual - payed_lefts - payed_supplements
-            else:
-                record.total_rest = 0.0
-
-    @api.depends('transactions_cash', 'percentage_cote_part', 'received_cash')
-    def _compute_cote(self):
-        for record in self:
-            if record.doctor:
-                record.total_cote_part = sum(line.cote_part for line in record.transactions_cash)
-                total_cote_recue = sum(line.montant for line in record.received_cash if line.motif == 'Cote part')
-                record.total_cote_recue = total_cote_recue
-                record.total_cote_rest = record.total_cote_part - total_cote_recue
-            else:
-                record.total_cote_part = 0.0
-                record.total_cote_recue = 0.0
-                record.total_cote_rest = 0.0
-
     _sql_constraints = [
         ('patient_sequance_unique', 'UNIQUE(patient_sequance, company_id)',
          'L\'identifiant doit être unique par compagnie !'),
@@ -13,10 +13,12 @@ class Prescription(models.Model):
     datetime = fields.Datetime(string="Date et heure", default=fields.Datetime.now)
     lines_ids = fields.One2many("clinic.medication.line", "prescription_id", string="Lignes de médicaments")
 
-    @api.model
-    def create(self, vals):
-        vals["name"] = self.env["ir.sequence"].next_by_code("clinic.prescription")
-        return super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        names = self.env["ir.sequence"].next_by_code_batch("clinic.prescription", len(vals_list))
+        for vals, name in zip(vals_list, names):
+            vals["name"] = name
+        return super().create(vals_list)
 
 class MedicationLine(models.Model):
     _name = "clinic.medication.line"
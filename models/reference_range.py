@@ -0,0 +1,172 @@
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Marque anormales les observations hors de leur intervalle de référence, en une requête pour tout le
+# lot. L'intervalle retenu est le plus spécifique : sexe du patient, puis tranche d'âge la plus étroite.
+# Les observations sans intervalle applicable gardent leur marquage manuel ; seul un marquage posé par
+# un intervalle (abnormal_auto) est levé quand plus aucun ne s'applique.
+FLAG_ABNORMAL_SQL = """
+    UPDATE clinic_observation o
+       SET is_abnormal = flag.abnormal, abnormal_auto = flag.matched
+      FROM (
+            SELECT obs.id, r.low IS NOT NULL AS matched,
+                   COALESCE(obs.value_float < r.low OR obs.value_float > r.high, FALSE) AS abnormal
+              FROM clinic_observation obs
+              JOIN res_partner p ON p.id = obs.patient_id
+              LEFT JOIN LATERAL (
+                    SELECT r.low, r.high
+                      FROM clinic_reference_range r
+                     WHERE r.active AND r.code = obs.code
+                       AND (r.gender IS NULL OR r.gender = p.gender)
+                       AND (r.unit IS NULL OR obs.value_unit IS NULL OR r.unit = obs.value_unit)
+                       AND CASE WHEN p.date_of_birth IS NULL THEN r.age_min = 0 AND r.age_max = 0
+                                ELSE DATE_PART('year', AGE(COALESCE(obs.datetime, obs.create_date), p.date_of_birth))
+                                     BETWEEN r.age_min AND COALESCE(NULLIF(r.age_max, 0), 200) - 1
+                           END
+                  ORDER BY r.gender IS NULL, r.age_max = 0, r.age_max - r.age_min
+                     LIMIT 1
+              ) r ON TRUE
+             WHERE obs.id = ANY(%(ids)s)
+               AND COALESCE(obs.value_str, '') = ''
+               AND (r.low IS NOT NULL OR obs.abnormal_auto)
+           ) flag
+     WHERE o.id = flag.id
+       AND (o.is_abnormal IS DISTINCT FROM flag.abnormal OR o.abnormal_auto IS DISTINCT FROM flag.matched)
+"""
+
+# Champs qui déterminent les observations couvertes par un intervalle
+RANGE_MATCH_FIELDS = {'code', 'gender', 'age_min', 'age_max', 'unit', 'active'}
+
+
+class ReferenceRange(models.Model):
+    _name = 'clinic.reference.range'
+    _description = "Intervalle de référence d'une observation"
+    _order = 'code, gender, age_min'
+
+    code = fields.Char(string='LOINC', required=True, index=True)
+    name = fields.Char(string='Libellé')
+    gender = fields.Selection([("male", "Homme"), ("female", "Femme")], string='Sexe',
+                              help="Vide : s'applique aux deux sexes")
+    age_min = fields.Integer(string='Âge minimum (ans)', default=0)
+    age_max = fields.Integer(string='Âge maximum (ans, exclu)', default=0, help="0 : pas de limite")
+    low = fields.Float(string='Borne basse', required=True)
+    high = fields.Float(string='Borne haute', required=True)
+    unit = fields.Char(string='Unité', help="Vide : s'applique quelle que soit l'unité de l'observation")
+    active = fields.Boolean(string='Actif', default=True)
+    pending_backfill = fields.Boolean(string='À réappliquer', readonly=True, copy=False,
+                                      help="Les observations existantes seront re-marquées par le cron")
+
+    _sql_constraints = [
+        ('range_check', 'CHECK(low <= high)', 'La borne basse doit être inférieure à la borne haute !'),
+        ('age_check', 'CHECK(age_max = 0 OR age_min < age_max)', "La tranche d'âge est invalide !"),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        ranges = super().create([dict(vals, pending_backfill=True) for vals in vals_list])
+        self.env.ref('clinic.cron_backfill_abnormal')._trigger()
+        return ranges
+
+    def write(self, vals):
+        codes = set(self.mapped('code')) if RANGE_MATCH_FIELDS.intersection(vals) else set()
+        if 'pending_backfill' not in vals:
+            vals = dict(vals, pending_backfill=True)
+            self.env.ref('clinic.cron_backfill_abnormal')._trigger()
+        result = super().write(vals)
+        # les observations des anciens codes ne sont plus couvertes par ces intervalles
+        self._release_codes(codes - set(self.mapped('code')))
+        return result
+
+    def unlink(self):
+        codes = set(self.mapped('code'))
+        result = super().unlink()
+        self._release_codes(codes)
+        return result
+
+    @api.model
+    def _release_codes(self, codes):
+        """
+        Reporte le retrait d'intervalles sur les observations de leurs codes : les intervalles restants
+        sont réappliqués par le cron ; sans intervalle restant, le marquage automatique est levé
+        directement (les marquages manuels sont conservés).
+        """
+        if not codes:
+            return
+        remaining = self.with_context(active_test=False).search([('code', 'in', list(codes))])
+        if remaining:
+            remaining.write({'pending_backfill': True})
+            self.env.ref('clinic.cron_backfill_abnormal')._trigger()
+        orphan_codes = list(codes - set(remaining.mapped('code')))
+        if orphan_codes:
+            self.env['clinic.observation'].flush_model(['code', 'is_abnormal', 'abnormal_auto'])
+            self.env.cr.execute("""
+                UPDATE clinic_observation SET is_abnormal = FALSE, abnormal_auto = FALSE
+                 WHERE code = ANY(%s) AND abnormal_auto
+            """, [orphan_codes])
+            self.env['clinic.observation'].invalidate_model(['is_abnormal', 'abnormal_auto'])
+
+    # ------------------------------------------------------------------ #
+    # Marquage des observations                                          #
+    # ------------------------------------------------------------------ #
+    @api.model
+    def _flag_observations(self, observation_ids):
+        """Compare en une passe toutes les observations données à leur intervalle de référence."""
+        if not observation_ids:
+            return
+        self.env['clinic.observation'].flush_model(
+            ['code', 'value_float', 'value_unit', 'value_str', 'datetime', 'patient_id', 'is_abnormal',
+             'abnormal_auto'])
+        self.env['res.partner'].flush_model(['gender', 'date_of_birth'])
+        self.flush_model()
+        self.env.cr.execute(FLAG_ABNORMAL_SQL, {'ids': list(observation_ids)})
+        self.env['clinic.observation'].invalidate_model(['is_abnormal', 'abnormal_auto'])
+
+    def action_backfill(self):
+        self.with_context(active_test=False).search([]).write({'pending_backfill': True})
+        self.env.ref('clinic.cron_backfill_abnormal')._trigger()
+
+    @api.model
+    def _cron_backfill(self):
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param('clinic.abnormal_backfill_chunk_size', 10000))
+        self._backfill(chunk_size, auto_commit=True)
+
+    @api.model
+    def _backfill(self, chunk_size, auto_commit=False):
+        """
+        Re-marque l'historique des observations dont un intervalle a changé, par paquets de
+        `chunk_size` parcourus dans l'ordre des ids, avec un commit par paquet.
+        """
+        ranges = self.with_context(active_test=False).search([('pending_backfill', '=', True)])
+        if not ranges:
+            return
+        # version lue de chaque intervalle : une modification concurrente le laisse à réappliquer
+        versions = ranges.read(['write_date'])
+        codes = list(set(ranges.mapped('code')))
+        last_id, total = 0, 0
+        while True:
+            self.env.cr.execute("""
+                SELECT id FROM clinic_observation
+                 WHERE code = ANY(%s) AND id > %s
+              ORDER BY id
+                 LIMIT %s
+            """, [codes, last_id, chunk_size])
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            self._flag_observations(ids)
+            total += len(ids)
+            last_id = ids[-1]
+            if auto_commit:
+                self.env.cr.commit()
+        self.env.cr.execute("""
+            UPDATE clinic_reference_range r SET pending_backfill = FALSE
+              FROM UNNEST(%s::int[], %s::timestamp[]) AS v(id, write_date)
+             WHERE r.id = v.id AND r.write_date = v.write_date
+        """, [[version['id'] for version in versions], [version['write_date'] for version in versions]])
+        self.invalidate_model(['pending_backfill'])
+        if auto_commit:
+            self.env.cr.commit()
+        _logger.info("Abnormal flags backfill for %s codes: %s observations", len(codes), total)
@@ -0,0 +1,72 @@
+import collections
+import logging
+import threading
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+# Blocs de numéros réservés par processus : {(dbname, sequence_id): deque de numéros}
+_reserved_numbers = {}
+_reserved_lock = threading.Lock()
+
+
+def _clear_reserved_numbers(dbname, sequence_ids):
+    with _reserved_lock:
+        for sequence_id in sequence_ids:
+            _reserved_numbers.pop((dbname, sequence_id), None)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def next_by_code_batch(self, sequence_code, count):
+        """
+        Comme next_by_code, mais réserve `count` numéros en un seul appel.
+        Retourne une liste de `count` références (False si la séquence n'existe pas).
+
+        Les séquences standard sont servies depuis un bloc de numéros réservé par le
+        processus (paramètre clinic.sequence_block_size), ce qui évite de solliciter la
+        séquence à chaque enregistrement ; la numérotation peut alors comporter des trous
+        et ne suit pas strictement l'ordre de création entre workers. Les séquences
+        « sans trou » (bons de caisse) restent attribuées une à une sous verrou.
+        """
+        if count <= 0:
+            return []
+        self.check_access_rights('read')
+        company_id = self.env.company.id
+        sequence = self.search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
+                               order='company_id', limit=1)
+        if not sequence:
+            _logger.debug("No ir.sequence has been found for code '%s'. Please make sure a sequence is set for "
+                          "current company.", sequence_code)
+            return [False] * count
+        sequence = sequence.sudo()
+        if sequence.implementation == 'standard' and not sequence.use_date_range:
+            return [sequence.get_next_char(number) for number in sequence._take_reserved_numbers(count)]
+        return [sequence._next() for _i in range(count)]
+
+    def _take_reserved_numbers(self, count):
+        """Prend `count` numéros dans le bloc du processus, en réservant un nouveau bloc si besoin."""
+        self.ensure_one()
+        block_size = int(self.env['ir.config_parameter'].sudo().get_param('clinic.sequence_block_size', 50))
+        with _reserved_lock:
+            reserved = _reserved_numbers.setdefault((self.env.cr.dbname, self.id), collections.deque())
+            missing = count - len(reserved)
+            if missing > 0:
+                # nextval n'est pas transactionnel : le bloc reste acquis même en cas de rollback
+                self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)",
+                                    ['ir_sequence_%03d' % self.id, max(missing, block_size)])
+                reserved.extend(number for number, in self.env.cr.fetchall())
+            return [reserved.popleft() for _i in range(count)]
+
+    def write(self, values):
+        result = super().write(values)
+        # les blocs des autres workers s'épuisent d'eux-mêmes
+        _clear_reserved_numbers(self.env.cr.dbname, self.ids)
+        return result
+
+    def unlink(self):
+        _clear_reserved_numbers(self.env.cr.dbname, self.ids)
+        return super().unlink()
@@ -1,6 +1,6 @@
 /** @odoo-module **/
 
-import { Component, useState, onWillStart } from "@odoo/owl";
+import { Component, useState, onWillStart, onWillUnmount } from "@odoo/owl";
 import { jsonrpc } from "@web/core/network/rpc_service";
 import { registry } from "@web/core/registry";
 import { useService } from "@web/core/utils/hooks";
@@ -10,86 +10,57 @@ export class DoctorEncounterForm extends Component {
 
     setup() {
         this.user = useService("user");
+        this.notification = useService("notification");
         this.state = useState({
             encounterId: null,
             encounter: {},
             patient: {},
             observations: [],
             prescriptions: [],
+            medicalHistory: [],
+            // LOINC catalogue entries matching the code being typed
+            codeSuggestions: [],
             loading: true,
         });
 
+        // Observation / prescription edits are queued and sent as one debounced batch
+        this.pending = [];
+        this.nextRef = 0;
+        this.flushTimer = null;
+        this.flushing = Promise.resolve();
+
         onWillStart(async () => {
             await this.loadDoctorEncounter();
         });
+        onWillUnmount(() => this.flushOperations());
     }
 
     /* ----------  LOAD  ---------- */
     async loadDoctorEncounter() {
         try {
-            // 1. Check if current user is linked to a doctor partner
             if (!this.user.userId) {
                 this.state.loading = false;
                 return;
             }
 
-            const doctorId = await jsonrpc("/clinic/user/doctor_id", {});
-            if (!doctorId) {
-                console.log("No doctor found for current user");
-                this.state.loading = false;
-                return;
-            }
-
-            const enc = await jsonrpc("/clinic/doctor/today_encounter", {
-                doctor_id: doctorId,
+            // Doctor, encounter, patient, observations, prescriptions and history in one request
+            const context = this.props.action?.context || {};
+            const data = await jsonrpc("/clinic/encounter/bootstrap", {
+                encounter_id: context.force_encounter_id || null,
             });
-            if (!enc || !enc.id) {
-                console.log("No encounter found for today");
+            if (!data.encounter) {
+                console.log(data.doctor ? "No encounter found for today" : "No doctor found for current user");
                 this.state.loading = false;
                 return;
             }
 
-            this.state.encounterId = enc.id;
-
-            // 4. Load encounter data (simplified - may need to implement these endpoints)
-            // For now, let's use basic Odoo model methods
-            const encounter = await jsonrpc("/web/dataset/call_kw", {
-                model: "clinic.encounter",
-                method: "read",
-                args: [[enc.id], ["name", "state", "chief_complaint", "diagnosis", "treatment_plan", "follow_up"]],
-                kwargs: {}
-            });
-
-            const patient = await jsonrpc("/web/dataset/call_kw", {
-                model: "res.partner",
-                method: "read",
-                args: [[enc.patient_id], ["name", "age", "gender", "phone"]],
-                kwargs: {}
-            });
-
-            // Initialize with safe defaults
-            this.state.encounter = encounter && encounter[0] ? encounter[0] : {
-                name: "N/A",
-                state: "draft",
-                chief_complaint: "",
-                diagnosis: "",
-                treatment_plan: "",
-                follow_up: ""
-            };
-
-            this.state.patient = patient && patient[0] ? patient[0] : {
-                name: "Unknown Patient",
-                age: "",
-                gender: "",
-                phone: "",
-            };
-
-            // Initialize empty arrays for now
-            this.state.observations = [];
-            this.state.prescriptions = [];
-
+            this.state.encounterId = data.encounter.id;
+            this.state.encounter = data.encounter;
+            this.state.patient = data.patient;
+            this.state.observations = data.observations;
+            this.state.prescriptions = data.prescriptions;
+            this.state.medicalHistory = data.medical_history;
             this.state.loading = false;
-            console.log("Loaded encounter data:", this.state);
 
         } catch (error) {
             console.error("Error loading doctor encounter:", error);
@@ -112,6 +83,7 @@ export class DoctorEncounterForm extends Component {
             };
             this.state.observations = [];
             this.state.prescriptions = [];
+            this.state.medicalHistory = [];
             this.state.loading = false;
         }
     }
@@ -144,6 +116,7 @@ export class DoctorEncounterForm extends Component {
         const nextState = MAP[currentState];
 
         if (!nextState || nextState === currentState) return;
+        await this.flushOperations();
 
         try {
             await jsonrpc("/web/dataset/call_kw", {
@@ -159,82 +132,113 @@ export class DoctorEncounterForm extends Component {
         }
     }
 
-    /* ----------  OBSERVATIONS  ---------- */
-    async addObs() {
-        if (!this.state.encounterId) return;
+    /* ----------  BATCHED OPERATIONS  ---------- */
+    queueOperation(model, op, record, vals = {}) {
+        // A record not sent yet only needs its pending create to be updated or dropped
+        const pendingCreate = this.pending.find(p => p.op === "create" && p.record.id === record.id);
+        if (pendingCreate && op === "write") {
+            Object.assign(pendingCreate.vals, vals);
+        } else if (pendingCreate && op === "unlink") {
+            this.pending = this.pending.filter(p => p !== pendingCreate);
+        } else {
+            this.pending.push({ model, op, record, vals });
+        }
+        clearTimeout(this.flushTimer);
+        this.flushTimer = setTimeout(() => this.flushOperations(), 500);
+    }
+
+    flushOperations() {
+        clearTimeout(this.flushTimer);
+        // Batches are sent one after the other, so records created by the previous one have their id
+        this.flushing = this.flushing.then(() => this.sendOperations());
+        return this.flushing;
+    }
 
+    async sendOperations() {
+        const pending = this.pending;
+        this.pending = [];
+        if (!pending.length || !this.state.encounterId) return;
         try {
-            const obs = await jsonrpc("/clinic/observation/create", {
+            const result = await jsonrpc("/clinic/encounter/batch", {
                 encounter_id: this.state.encounterId,
-                code: "NEW",
-                value_float: 0,
-                value_unit: "",
+                operations: pending.map(({ model, op, record, vals }) =>
+                    op === "create" ? { model, op, ref: record.id, vals } : { model, op, id: record.id, vals }
+                ),
             });
-            this.state.observations.push(obs);
+            for (const { model, op, record } of pending) {
+                if (op === "create") {
+                    Object.assign(record, result.created[model][record.id]);
+                }
+            }
         } catch (error) {
-            console.error("Error adding observation:", error);
+            console.error("Error saving observations and prescriptions:", error);
+            // The batch was rolled back: its new records were not created, so drop their
+            // placeholders and the edits queued on them since, which could never be sent
+            const failed = new Set(pending.filter(p => p.op === "create").map(p => p.record.id));
+            this.pending = this.pending.filter(p => !failed.has(p.record.id));
+            this.state.observations = this.state.observations.filter(o => !failed.has(o.id));
+            this.state.prescriptions = this.state.prescriptions.filter(r => !failed.has(r.id));
+            this.notification.add("Les modifications n'ont pas pu être enregistrées.", { type: "danger" });
         }
     }
 
-    async removeObs(id) {
-        try {
-            await jsonrpc("/clinic/observation/unlink", { id });
-            this.state.observations = this.state.observations.filter(o => o.id !== id);
-        } catch (error) {
-            console.error("Error removing observation:", error);
-        }
+    /* ----------  OBSERVATIONS  ---------- */
+    addObs() {
+        if (!this.state.encounterId) return;
+        const vals = { code: "NEW", value_float: 0, value_unit: "" };
+        this.state.observations.push({ id: `new_${this.nextRef++}`, ...vals });
+        const obs = this.state.observations[this.state.observations.length - 1];
+        this.queueOperation("observation", "create", obs, { ...vals });
+    }
+
+    removeObs(id) {
+        const obs = this.state.observations.find(o => o.id === id);
+        this.state.observations = this.state.observations.filter(o => o.id !== id);
+        this.queueOperation("observation", "unlink", obs);
     }
 
-    async saveObservation(obs) {
+    saveObservation(obs) {
+        this.queueOperation("observation", "write", obs, {
+            code: obs.code,
+            value_float: parseFloat(obs.value_float) || 0,
+            value_unit: obs.value_unit,
+        });
+    }
+
+    async searchCodes(term) {
+        const requested = (term || "").trim();
+        this.codeTerm = requested;
+        if (requested.length < 2) {
+            this.state.codeSuggestions = [];
+            return;
+        }
         try {
-            await jsonrpc("/clinic/observation/update", {
-                id: obs.id,
-                vals: {
-                    code: obs.code,
-                    value_float: obs.value_float,
-                    value_unit: obs.value_unit,
-                },
-            });
+            const codes = await jsonrpc("/clinic/code/autocomplete", { system: "loinc", term: requested, limit: 20 });
+            // ignore answers to a term that has been typed over since
+            if (this.codeTerm === requested) {
+                this.state.codeSuggestions = codes;
+            }
         } catch (error) {
-            console.error("Error saving observation:", error);
+            console.error("Error searching clinical codes:", error);
         }
     }
 
     /* ----------  PRESCRIPTIONS  ---------- */
-    async addRx() {
+    addRx() {
         if (!this.state.encounterId) return;
-
-        try {
-            const rx = await jsonrpc("/clinic/prescription/create", {
-                encounter_id: this.state.encounterId,
-                name: "Nouveau médicament",
-            });
-            this.state.prescriptions.push(rx);
-        } catch (error) {
-            console.error("Error adding prescription:", error);
-        }
+        this.state.prescriptions.push({ id: `new_${this.nextRef++}`, name: "" });
+        const rx = this.state.prescriptions[this.state.prescriptions.length - 1];
+        this.queueOperation("prescription", "create", rx, {});
     }
 
-    async removeRx(id) {
-        try {
-            await jsonrpc("/clinic/prescription/unlink", { id });
-            this.state.prescriptions = this.state.prescriptions.filter(r => r.id !== id);
-        } catch (error) {
-            console.error("Error removing prescription:", error);
-        }
+    removeRx(id) {
+        const rx = this.state.prescriptions.find(r => r.id === id);
+        this.state.prescriptions = this.state.prescriptions.filter(r => r.id !== id);
+        this.queueOperation("prescription", "unlink", rx);
     }
 
-    async savePrescription(rx) {
-        try {
-            await jsonrpc("/clinic/prescription/update", {
-                id: rx.id,
-                vals: {
-                    name: rx.name,
-                },
-            });
-        } catch (error) {
-            console.error("Error saving prescription:", error);
-        }
+    savePrescription(rx) {
+        this.queueOperation("prescription", "write", rx, { name: rx.name });
     }
 
     /* ----------  UTILITY METHODS  ---------- */
@@ -1,6 +1,6 @@
 /** @odoo-module **/
 
-import { Component, useState, useRef, onWillStart, onMounted } from "@odoo/owl";
+import { Component, useState, useRef, onWillStart, onMounted, onWillUnmount } from "@odoo/owl";
 import { registry } from "@web/core/registry";
 import { _t } from "@web/core/l10n/translation";
 import { jsonrpc } from "@web/core/network/rpc_service";
@@ -31,6 +31,8 @@ class ManagerDashboard extends Component {
         this.orOccupationChartRef = useRef('orOccupationChart'); // ADD THIS LINE
 
         this.charts = {};
+        // ETag of the last payload, the server answers "unchanged" when it still matches
+        this.etag = null;
 
         onWillStart(async () => {
             await this.fetchData();
@@ -41,13 +43,22 @@ class ManagerDashboard extends Component {
             if (!this.state.loading && !this.state.error) {
                 this.renderCharts();
             }
+            this.pollInterval = setInterval(() => this.fetchData(), 30000);
+        });
+
+        onWillUnmount(() => {
+            clearInterval(this.pollInterval);
         });
     }
 
     async fetchData() {
         try {
+            const result = await jsonrpc("/manager/dashboard/data", { etag: this.etag });
+            if (result.unchanged) {
+                return;
+            }
             this.state.loading = true;
-            const result = await jsonrpc("/manager/dashboard/data", {});
+            this.etag = result.etag || null;
 
             console.log(result);
             this.state.total_patients = result.total_patients || 0;
@@ -0,0 +1,78 @@
+/** @odoo-module **/
+
+import { Component, useState, onWillStart, onWillUnmount } from "@odoo/owl";
+import { deserializeDateTime } from "@web/core/l10n/dates";
+import { jsonrpc } from "@web/core/network/rpc_service";
+import { registry } from "@web/core/registry";
+import { useService } from "@web/core/utils/hooks";
+
+class WaitingBoard extends Component {
+    static template = "clinic.WaitingBoard";
+
+    setup() {
+        this.busService = useService("bus_service");
+        this.state = useState({
+            stages: [],
+            services: [],
+            // {id: appointment}
+            appointments: {},
+            loading: true,
+        });
+        // services shown on the board, from the action context (all services by default)
+        const context = this.props.action.context || {};
+        this.serviceIds = context.service_ids || (context.service_id ? [context.service_id] : null);
+        this.channels = [];
+        this.onUpdate = (diff) => this.applyDiff(diff);
+
+        onWillStart(async () => {
+            await this.loadBoard();
+            this.busService.subscribe("clinic_waiting_board/update", this.onUpdate);
+        });
+
+        onWillUnmount(() => {
+            this.busService.unsubscribe("clinic_waiting_board/update", this.onUpdate);
+            for (const channel of this.channels) {
+                this.busService.deleteChannel(channel);
+            }
+        });
+    }
+
+    async loadBoard() {
+        const result = await jsonrpc("/clinic/waiting_board/data", { service_ids: this.serviceIds });
+        this.state.stages = result.stages;
+        this.state.services = result.services;
+        this.state.appointments = Object.fromEntries(result.appointments.map((a) => [a.id, a]));
+        for (const channel of result.channels) {
+            if (!this.channels.includes(channel)) {
+                this.busService.addChannel(channel);
+                this.channels.push(channel);
+            }
+        }
+        this.state.loading = false;
+    }
+
+    /** Apply a {upsert: [...], remove: [...]} diff received on the bus. */
+    applyDiff(diff) {
+        for (const id of diff.remove) {
+            delete this.state.appointments[id];
+        }
+        for (const appointment of diff.upsert) {
+            if (!this.serviceIds || this.serviceIds.includes(appointment.service_id)) {
+                this.state.appointments[appointment.id] = appointment;
+            }
+        }
+    }
+
+    appointmentsOf(stage) {
+        return Object.values(this.state.appointments)
+            .filter((a) => a.stage_id === stage.id)
+            .sort((a, b) => (a.priorite === b.priorite ? a.date_rdv.localeCompare(b.date_rdv)
+                                                      : a.priorite === "urgente" ? -1 : 1));
+    }
+
+    formatTime(datetime) {
+        return deserializeDateTime(datetime).toFormat("HH:mm");
+    }
+}
+
+registry.category("actions").add("clinic.waiting_board", WaitingBoard);
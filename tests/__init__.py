@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import test_cash_entry_compute
+from . import test_patient_search
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged('post_install', '-at_install')
+class TestCashEntryCompute(TransactionCase):
+    """Montants d'un encaissement : un seul calcul par flush, quel que soit le nombre de lignes modifiées."""
+
+    LINE_COUNT = 500
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.patient = cls.env['res.partner'].create({'name': 'Patient Test', 'patient': True})
+        cls.act = cls.env['product.product'].create({
+            'name': 'Consultation Test',
+            'is_medical_act': True,
+            'list_price': 100.0,
+        })
+        cls.statement = cls.env['clinic.cash_statement'].create({})
+        cls.entry = cls.env['clinic.cash_entry'].create({
+            'patient_id': cls.patient.id,
+            'statement_id': cls.statement.id,
+            'acts_ids': [(0, 0, {'act_id': cls.act.id}) for _i in range(cls.LINE_COUNT)],
+        })
+        cls.env.flush_all()
+
+    def test_bulk_line_edit_single_compute(self):
+        CashEntry = self.registry['clinic.cash_entry']
+        compute_amount = CashEntry._compute_amount
+        calls = []
+
+        def _compute_amount(records):
+            calls.append(len(records))
+            return compute_amount(records)
+
+        lines = self.entry.acts_ids
+        self.assertEqual(len(lines), self.LINE_COUNT)
+        queries_before = self.cr.sql_log_count
+        started = time.perf_counter()
+        with patch.object(CashEntry, '_compute_amount', _compute_amount):
+            lines.write({'difference_amount': 10.0, 'tax': '9%'})
+            self.env.flush_all()
+        elapsed = time.perf_counter() - started
+        _logger.info("Bulk edit of %s cash entry lines: %s entry compute call(s), %s queries, %.3fs",
+                     len(lines), len(calls), self.cr.sql_log_count - queries_before, elapsed)
+
+        self.assertEqual(calls, [1], "les montants de l'encaissement doivent être calculés une seule fois")
+        self.assertAlmostEqual(self.entry.montant, self.LINE_COUNT * 110.0)
+        self.assertAlmostEqual(self.entry.tax_amount, self.LINE_COUNT * 110.0 * 0.09)
+        self.assertAlmostEqual(self.entry.amount_total, self.LINE_COUNT * 110.0 * 1.09)
+        self.assertAlmostEqual(self.entry.amount_residual, self.entry.amount_total)
+        self.assertEqual(self.entry.payment_state, 'Non payé')
+
+    def test_payment_state(self):
+        self.entry.amount_payed = self.entry.amount_total / 2
+        self.assertEqual(self.entry.payment_state, 'Partiellement payé')
+        self.entry.amount_payed = self.entry.amount_total
+        self.assertEqual(self.entry.payment_state, 'Payé')
+        self.assertEqual(self.entry.amount_residual, 0)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestPatientSearch(TransactionCase):
+    """Recherche des patients dans les champs Many2one (res.partner._name_search)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Partner = cls.env['res.partner']
+        cls.patient = Partner.create({'name': 'Zerrouki Amina', 'patient': True, 'num_carte_chifa': '4455667788'})
+        cls.other_patient = Partner.create({'name': 'Zerrouki Yacine', 'patient': True})
+        cls.company_contact = Partner.create({'name': 'Zerrouki Transports'})
+
+    def test_name_search_list_domain(self):
+        # domaine tel qu'envoyé par le client web : feuilles en listes JSON
+        results = self.env['res.partner'].name_search('Zerrouki Amina', args=[['patient', '=', True]])
+        self.assertEqual([partner_id for partner_id, _name in results], [self.patient.id])
+
+    def test_name_search_tuple_domain(self):
+        results = self.env['res.partner'].name_search('Zerrouki', args=[('patient', '=', True)])
+        self.assertEqual({partner_id for partner_id, _name in results}, {self.patient.id, self.other_patient.id})
+
+    def test_name_search_chifa_number(self):
+        results = self.env['res.partner'].name_search('55667', args=[['patient', '=', True]])
+        self.assertEqual([partner_id for partner_id, _name in results], [self.patient.id])
+
+    def test_name_search_without_patient_domain(self):
+        results = self.env['res.partner'].name_search('Zerrouki Transports')
+        self.assertIn(self.company_contact.id, [partner_id for partner_id, _name in results])